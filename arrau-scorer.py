@@ -1,7 +1,7 @@
 import sys
+from coval.arrau import non_referring
 from coval.arrau import reader
 from coval.eval import evaluator
-from coval.eval.evaluator import evaluate_non_referrings
 
 __author__ = 'ns-moosavi'
 
@@ -9,7 +9,8 @@ __author__ = 'ns-moosavi'
 def main():
     metric_dict = {
             'lea': evaluator.lea, 'muc': evaluator.muc,
-            'bcub': evaluator.b_cubed, 'ceafe': evaluator.ceafe}
+            'bcub': evaluator.b_cubed, 'ceafe': evaluator.ceafe,
+            'blanc': evaluator.blanc}
     key_directory = sys.argv[1]
     sys_directory = sys.argv[2]
 
@@ -63,17 +64,25 @@ def main():
 def evaluate(key_directory, sys_directory, metrics, keep_singletons,
         keep_non_referring, use_MIN):
 
-    doc_coref_infos, doc_non_referring_infos = reader.get_coref_infos(
+    multi_evaluator = evaluator.MultiEvaluator([metric
+            for _, metric in metrics], beta=1)
+    non_referring_evaluator = evaluator.Evaluator(
+            non_referring.non_referrings)
+
+    # The documents are scored as soon as they are read
+    for _, coref_info, non_referring_info in reader.iter_coref_infos(
             key_directory, sys_directory, keep_singletons, keep_non_referring,
-            use_MIN)
+            use_MIN):
+        multi_evaluator.update(coref_info)
+        if keep_non_referring:
+            non_referring_evaluator.add_counts(*non_referring.non_referrings(
+                    *non_referring_info))
 
     conll = 0
     conll_subparts_num = 0
 
-    for name, metric in metrics:
-        recall, precision, f1 = evaluator.evaluate_documents(doc_coref_infos,
-                metric,
-                beta=1)
+    for (name, metric), (recall, precision, f1) in zip(metrics,
+            multi_evaluator.get_scores()):
         if name in ["muc", "bcub", "ceafe"]:
             conll += f1
             conll_subparts_num += 1
@@ -88,8 +97,9 @@ def evaluate(key_directory, sys_directory, metrics, keep_singletons,
         print('CoNLL score: %.2f' % conll)
 
     if keep_non_referring:
-        recall, precision, f1 = evaluate_non_referrings(
-                doc_non_referring_infos)
+        recall, precision, f1 = (non_referring_evaluator.get_recall(),
+                non_referring_evaluator.get_precision(),
+                non_referring_evaluator.get_f1())
         print('============================================')
         print('Non-referring markable identification scores:')
         print('Recall: %.2f' % (recall * 100),
@@ -1,3 +1,6 @@
+from bisect import bisect_left, bisect_right
+
+
 class Markable:
     def __init__(self, doc_name, start, end, MIN, is_referring, words):
         self.doc_name = doc_name
@@ -42,3 +45,78 @@ class Markable:
                     self.doc_name, self.start, self.end, ' '.join(self.words),
                     '(%d, %d)' % self.MIN if self.MIN else '',
                     self.is_referring))
+
+
+class MarkableIndex:
+    """Finds the indexed markables that are equal to a query markable
+    without comparing the query with all of them.
+
+    Markable equality is exact for spans without MIN.  A markable with MIN
+    is equal to any markable that starts between its start and MIN start
+    and ends between its MIN end and its end, and if both markables have a
+    MIN, the MIN of the left operand is used.  Exact spans are therefore
+    looked up in a dict, the MIN of a query is a range query on the
+    markables sorted by their starts, and the MIN of an indexed markable is
+    looked up by every start position that it accepts.
+    """
+
+    def __init__(self, markables):
+        self.markables = list(markables)
+        # (doc_name, start, end) of the markables without MIN
+        self.spans = {}
+        # The sorted starts and the (end, position) of the markables of
+        # each document, for the MIN of queries
+        self.starts = {}
+        # (doc_name, accepted start) of the markables with MIN
+        self.MIN_starts = {}
+
+        doc_markables = {}
+        for position, m in enumerate(self.markables):
+            doc_markables.setdefault(m.doc_name, []).append(
+                    (m.start, m.end, position))
+            if m.MIN:
+                for start in range(m.start, m.MIN[0] + 1):
+                    self.MIN_starts.setdefault((m.doc_name, start),
+                            []).append((m.MIN[1], m.end, position))
+            else:
+                self.spans.setdefault((m.doc_name, m.start, m.end),
+                        []).append(position)
+
+        for doc_name, spans in doc_markables.items():
+            spans.sort()
+            self.starts[doc_name] = ([start for start, _, _ in spans],
+                    [(end, position) for _, end, position in spans])
+
+    def find(self, m, indexed_first=True):
+        """Returns the positions, in increasing order, of the indexed
+        markables x for which x == m, or m == x if not indexed_first."""
+        positions = []
+
+        # The MIN of the indexed markable is used
+        if not m.MIN or indexed_first:
+            positions.extend(position for MIN_end, end, position
+                    in self.MIN_starts.get((m.doc_name, m.start), ())
+                    if MIN_end <= m.end <= end)
+
+        if m.MIN:
+            # The MIN of the query is used
+            starts, spans = self.starts.get(m.doc_name, ((), ()))
+            for end, position in spans[bisect_left(starts, m.start):
+                    bisect_right(starts, m.MIN[0])]:
+                if m.MIN[1] <= end <= m.end and not (
+                        indexed_first and self.markables[position].MIN):
+                    positions.append(position)
+        else:
+            positions.extend(self.spans.get((m.doc_name, m.start, m.end),
+                    ()))
+
+        return sorted(positions)
+
+    def find_first(self, m, indexed_first=True):
+        """Returns the position of the first indexed markable that find
+        returns, or None."""
+        positions = self.find(m, indexed_first)
+        return positions[0] if positions else None
+
+    def contains(self, m, indexed_first=True):
+        return bool(self.find(m, indexed_first))
@@ -0,0 +1,54 @@
+"""Evaluation of the identification of the non-referring markables of the
+ARRAU dataset."""
+from coval.arrau import markable
+from coval.eval import evaluator
+
+
+def evaluate_non_referrings(doc_non_referring_infos):
+    e = get_non_referring_evaluator(doc_non_referring_infos)
+    return e.get_recall(), e.get_precision(), e.get_f1()
+
+
+def get_non_referring_evaluator(doc_non_referring_infos,
+        keep_aggregated_values=False):
+    """Returns the Evaluator of the non_referrings counts of all the
+    documents, which keeps the per-document counts for the bootstrap if
+    keep_aggregated_values is set."""
+    e = evaluator.Evaluator(non_referrings,
+            keep_aggregated_values=keep_aggregated_values)
+    for doc_id in doc_non_referring_infos:
+        e.add_counts(*non_referrings(*doc_non_referring_infos[doc_id]))
+    return e
+
+
+def non_referrings(key_non_referrings, sys_non_referrings):
+    """Returns the (tp, tp + fp, tp, tp + fn) of the identification of the
+    non-referring markables of a document.  A key markable is found if it
+    is equal to a system markable, with the MIN semantics of
+    Markable.__eq__, which the MarkableIndexes apply without comparing all
+    the pairs of markables."""
+    sys_index = markable.MarkableIndex(sys_non_referrings)
+    key_index = markable.MarkableIndex(key_non_referrings)
+
+    tp = sum(1 for m in key_non_referrings if sys_index.contains(m))
+    fp = sum(1 for m in sys_non_referrings if not key_index.contains(m))
+    fn = len(key_non_referrings) - tp
+    return tp, tp + fp, tp, tp + fn
+
+
+def pairwise_non_referrings(key_non_referrings, sys_non_referrings):
+    """non_referrings by comparing all the pairs of markables."""
+    tp, fp, fn = 0, 0, 0
+    for m in key_non_referrings:
+        if m in sys_non_referrings:
+            tp += 1
+        else:
+            fn += 1
+    for m in sys_non_referrings:
+        if m not in key_non_referrings:
+            fp += 1
+    return tp, tp + fp, tp, tp + fn
+
+
+# Evaluators of non_referrings can be restored by evaluator.from_dict
+evaluator.METRICS[non_referrings.__name__] = non_referrings
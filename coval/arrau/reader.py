@@ -1,3 +1,5 @@
+from collections.abc import Mapping
+from concurrent.futures import Future, ThreadPoolExecutor
 from os import walk
 from os.path import isfile, join
 from coval.arrau import markable
@@ -78,7 +80,7 @@ def get_doc_markables(doc_name, doc_lines, extract_MIN, word_column=0,
 
                 else:
                     print((
-                            '%r is not a valid annotation for markables.\n',
+                            '%r is not a valid annotation for markables.\n'
                             'The annotation of the following markable will be '
                             'skipped then.\n%s') % (markable_annotation, line))
 
@@ -130,52 +132,104 @@ def get_coref_infos(key_directory,
         use_MIN,
         print_debug=False):
 
-    key_docs = get_all_docs(key_directory)
-    sys_docs = get_all_docs(sys_directory)
-
     doc_coref_infos = {}
     doc_non_referrig_infos = {}
 
-    for doc in key_docs:
+    for doc, coref_info, non_referring_info in iter_coref_infos(
+            key_directory, sys_directory, keep_singletons,
+            keep_non_referring, use_MIN, print_debug):
+        doc_coref_infos[doc] = coref_info
+        doc_non_referrig_infos[doc] = non_referring_info
 
-        if doc not in sys_docs:
-            print('The document ', doc,
-                    ' does not exist in the system output.')
-            continue
+    return doc_coref_infos, doc_non_referrig_infos
 
-        key_clusters = get_doc_markables(doc, key_docs[doc], use_MIN)
-        sys_clusters = get_doc_markables(doc, sys_docs[doc], False)
 
-        (key_clusters, key_non_referrings, key_removed_non_referring,
-                key_removed_singletons) = process_clusters(
-                key_clusters, keep_singletons, keep_non_referring)
-        (sys_clusters, sys_non_referrings, sys_removed_non_referring,
-                sys_removed_singletons) = process_clusters(
-                sys_clusters, keep_singletons, keep_non_referring)
+def iter_coref_infos(key_directory,
+        sys_directory,
+        keep_singletons,
+        keep_non_referring,
+        use_MIN,
+        print_debug=False,
+        prefetch_docs=16):
+    """Yields (doc, coref_info, (key_non_referrings, sys_non_referrings))
+    for the documents of the key directory, in the order of
+    get_coref_infos.  The files of the next `prefetch_docs` documents are
+    read in background threads while a document is processed."""
+    key_docs = get_all_docs(key_directory)
+    sys_docs = get_all_docs(sys_directory)
+    docs = list(key_docs)
 
-        sys_mention_key_cluster = get_markable_assignments(
-                sys_clusters, key_clusters)
-        key_mention_sys_cluster = get_markable_assignments(
-                key_clusters, sys_clusters)
+    try:
+        for i, doc in enumerate(docs):
+            key_docs.prefetch(docs[i:i + prefetch_docs])
+            sys_docs.prefetch(docs[i:i + prefetch_docs])
 
-        doc_coref_infos[doc] = (key_clusters, sys_clusters,
-                    key_mention_sys_cluster, sys_mention_key_cluster)
-        doc_non_referrig_infos[doc] = (key_non_referrings, sys_non_referrings)
+            if doc not in sys_docs:
+                print('The document ', doc,
+                        ' does not exist in the system output.')
+                key_docs.release(doc)
+                continue
 
-        if print_debug and not keep_non_referring:
-            print('%s and %s non-referring markables are removed from the '
-                    'evaluations of the key and system files, respectively.'
-                    % (key_removed_non_referring, sys_removed_non_referring))
+            key_clusters = get_doc_markables(doc, key_docs[doc], use_MIN)
+            sys_clusters = get_doc_markables(doc, sys_docs[doc], False)
+            key_docs.release(doc)
+            sys_docs.release(doc)
+
+            (key_clusters, key_non_referrings, key_removed_non_referring,
+                    key_removed_singletons) = process_clusters(
+                    key_clusters, keep_singletons, keep_non_referring)
+            (sys_clusters, sys_non_referrings, sys_removed_non_referring,
+                    sys_removed_singletons) = process_clusters(
+                    sys_clusters, keep_singletons, keep_non_referring)
+
+            sys_mention_key_cluster = get_markable_assignments(
+                    sys_clusters, key_clusters)
+            key_mention_sys_cluster = get_markable_assignments(
+                    key_clusters, sys_clusters)
+
+            if print_debug and not keep_non_referring:
+                print('%s and %s non-referring markables are removed from '
+                        'the evaluations of the key and system files, '
+                        'respectively.' % (key_removed_non_referring,
+                        sys_removed_non_referring))
+
+            if print_debug and not keep_singletons:
+                print('%s and %s singletons are removed from the evaluations '
+                        'of the key and system files, respectively.'
+                        % (key_removed_singletons, sys_removed_singletons))
+
+            yield doc, (key_clusters, sys_clusters, key_mention_sys_cluster,
+                    sys_mention_key_cluster), (key_non_referrings,
+                    sys_non_referrings)
+    finally:
+        key_docs.close()
+        sys_docs.close()
 
-        if print_debug and not keep_singletons:
-            print('%s and %s singletons are removed from the evaluations of '
-                    'the key and system files, respectively.'
-                    % (key_removed_singletons, sys_removed_singletons))
 
-    return doc_coref_infos, doc_non_referrig_infos
+def get_markable_assignments(inp_clusters, out_clusters):
+    """Assigns each input markable to the cluster of the first output
+    markable that it is equal to.  The output markables are looked up in a
+    MarkableIndex instead of being compared one by one."""
+    markable_cluster_ids = {}
+    out_dic = {}
+    for cluster_id, cluster in enumerate(out_clusters):
+        for m in cluster:
+            out_dic[m] = cluster_id
 
+    out_markables = list(out_dic)
+    out_index = markable.MarkableIndex(out_markables)
+    for cluster in inp_clusters:
+        for im in cluster:
+            position = out_index.find_first(im, indexed_first=False)
+            if position is not None:
+                markable_cluster_ids[im] = out_dic[out_markables[position]]
 
-def get_markable_assignments(inp_clusters, out_clusters):
+    return markable_cluster_ids
+
+
+def get_pairwise_markable_assignments(inp_clusters, out_clusters):
+    """get_markable_assignments by comparing all the pairs of
+    markables."""
     markable_cluster_ids = {}
     out_dic = {}
     for cluster_id, cluster in enumerate(out_clusters):
@@ -193,16 +247,66 @@ def get_markable_assignments(inp_clusters, out_clusters):
 
 
 def get_all_docs(path):
-    all_docs = {}
+    """Returns the LazyDocs of the .CONLL files of `path`, which is a file
+    or a directory that is searched recursively."""
+    doc_paths = {}
     if isfile(path):
         if path.endswith('.CONLL'):
-            all_docs[path[path.rfind('/') + 1:]] = get_doc_lines(path)
+            doc_paths[path[path.rfind('/') + 1:]] = path
     else:
         for root, _directories, filenames in walk(path):
             for filename in filenames:
                 if (filename.endswith('.CONLL')):
-                    all_docs[filename] = get_doc_lines(join(root, filename))
-    return all_docs
+                    doc_paths[filename] = join(root, filename)
+    return LazyDocs(doc_paths)
+
+
+class LazyDocs(Mapping):
+    """The get_doc_lines of documents by file name.  A file is only read
+    when its document is first accessed, or in a background thread once
+    it is prefetched, so reading the next files overlaps with processing
+    the current one.  The lines of a document are dropped by release."""
+
+    def __init__(self, doc_paths, max_workers=8):
+        self.doc_paths = doc_paths
+        self.max_workers = max_workers
+        self.docs = {}
+        self.executor = None
+
+    def __getitem__(self, doc):
+        lines = self.docs.get(doc)
+        if lines is None:
+            lines = get_doc_lines(self.doc_paths[doc])
+        elif isinstance(lines, Future):
+            lines = lines.result()
+        self.docs[doc] = lines
+        return lines
+
+    def __contains__(self, doc):
+        return doc in self.doc_paths
+
+    def __iter__(self):
+        return iter(self.doc_paths)
+
+    def __len__(self):
+        return len(self.doc_paths)
+
+    def prefetch(self, docs):
+        """Starts reading the files of `docs` in background threads."""
+        if self.executor is None:
+            self.executor = ThreadPoolExecutor(max_workers=self.max_workers)
+        for doc in docs:
+            if doc in self.doc_paths and doc not in self.docs:
+                self.docs[doc] = self.executor.submit(get_doc_lines,
+                        self.doc_paths[doc])
+
+    def release(self, doc):
+        self.docs.pop(doc, None)
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
 
 
 def get_doc_lines(file_name):
@@ -0,0 +1,127 @@
+"""Scoring many system outputs against a single key file.
+
+The key file is read and processed once.  Its clusters, the mention to
+cluster index of each key document and, when parse trees are needed for
+the system mentions, the AnnotatedParseTrees of the key lines are kept in a
+KeyDocuments object that is shared by the scoring of all the system files.
+"""
+import os
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from coval.conll import reader
+from coval.eval import evaluator
+
+
+class KeyDocuments:
+    def __init__(self, key_file, NP_only=False, remove_nested=False,
+            keep_singletons=True, min_span=False, key_cache=None):
+        self.options = (NP_only, remove_nested, keep_singletons, min_span)
+        self.keep_key_lines = NP_only or min_span
+        self.docs = []
+        self.stats = Counter()
+
+        cached_key = key_cache.load(key_file, *self.options) if (
+                key_cache) else None
+        if cached_key:
+            for doc in cached_key.docs:
+                key_clusters, key_stats = cached_key.get_doc(doc)
+                self.stats.update(key_stats)
+                self.docs.append((doc, key_clusters,
+                        reader.get_mention_index(key_clusters)))
+            if self.keep_key_lines:
+                self.parse_trees = {doc: reader.AnnotatedParseTrees(
+                        key_doc_lines) for doc, key_doc_lines in
+                        reader.iter_doc_lines(key_file)}
+                if min_span:
+                    for doc, key_clusters, _ in self.docs:
+                        self.parse_trees[doc].add_min_spans(key_clusters)
+            return
+
+        key_builder = key_cache.builder(key_file, *self.options) if (
+                key_cache) else None
+        self.parse_trees = {}
+        for doc, key_doc_lines in reader.iter_doc_lines(key_file):
+            key_stats = Counter()
+            parse_trees = reader.AnnotatedParseTrees(key_doc_lines) if (
+                    self.keep_key_lines) else None
+            key_clusters = reader.get_doc_clusters(doc, key_doc_lines,
+                    key_doc_lines, *self.options, stats=key_stats,
+                    side='key', parse_trees=parse_trees)
+            self.stats.update(key_stats)
+            self.docs.append((doc, key_clusters,
+                    reader.get_mention_index(key_clusters)))
+            if self.keep_key_lines:
+                self.parse_trees[doc] = parse_trees
+            if key_builder:
+                key_builder.add(doc, key_clusters, key_stats)
+
+        if key_builder:
+            key_builder.save()
+
+    def iter_docs(self):
+        """Yields (doc, (parse_trees, key_clusters, key_mention_index))."""
+        for doc, key_clusters, key_mention_index in self.docs:
+            yield doc, (self.parse_trees[doc] if self.keep_key_lines
+                    else None, key_clusters, key_mention_index)
+
+    def evaluate(self, sys_file, metrics, beta=1,
+            keep_aggregated_values=False):
+        """Returns the Evaluators of `metrics` for `sys_file` and the
+        numbers of removed system singletons and nested mentions."""
+        multi_evaluator = evaluator.MultiEvaluator([metric
+                for _, metric in metrics], beta=beta,
+                keep_aggregated_values=keep_aggregated_values)
+        stats = Counter()
+
+        for doc, (parse_trees, key_clusters, key_mention_index), \
+                sys_doc_lines in reader.align_doc_lines(self.iter_docs(),
+                sys_file):
+            coref_info = reader.get_doc_coref_info(doc,
+                    parse_trees.doc_lines if parse_trees else None,
+                    sys_doc_lines, *self.options, stats=stats,
+                    key_clusters=key_clusters,
+                    key_mention_index=key_mention_index,
+                    parse_trees=parse_trees)
+            multi_evaluator.update(coref_info)
+
+        return multi_evaluator.evaluators, stats
+
+
+# The KeyDocuments of the worker processes of evaluate_systems
+worker_key_documents = None
+
+
+def init_worker(key_documents):
+    global worker_key_documents
+    worker_key_documents = key_documents
+
+
+def evaluate_worker_system(sys_file, metrics, beta):
+    evaluators, stats = worker_key_documents.evaluate(sys_file, metrics, beta)
+    return [e.get_counts() for e in evaluators], stats
+
+
+def evaluate_systems(key_documents, sys_files, metrics, jobs=1, beta=1):
+    """Yields (sys_file, evaluators, stats) for each of `sys_files`, in
+    order.  With jobs > 1 the system files are scored in parallel
+    processes that each receive a copy of `key_documents`."""
+    if jobs == 1:
+        for sys_file in sys_files:
+            yield (sys_file,) + key_documents.evaluate(sys_file, metrics,
+                    beta)
+        return
+
+    with ProcessPoolExecutor(max_workers=jobs or os.cpu_count(),
+            initializer=init_worker,
+            initargs=(key_documents,)) as executor:
+        futures = [executor.submit(evaluate_worker_system, sys_file,
+                metrics, beta)
+                for sys_file in sys_files]
+        for sys_file, future in zip(sys_files, futures):
+            counts, stats = future.result()
+            evaluators = []
+            for (_, metric), metric_counts in zip(metrics, counts):
+                e = evaluator.Evaluator(metric, beta=beta)
+                e.add_counts(*metric_counts)
+                evaluators.append(e)
+            yield sys_file, evaluators, stats
@@ -0,0 +1,222 @@
+"""On-disk cache of processed key files.
+
+Scoring many system outputs against the same key repeats the key-side work:
+extracting the mentions, building their parse trees, computing minimum
+spans and pruning VP or nested mentions.  A KeyCache stores the resulting
+key clusters once per key file content and evaluation options.
+
+Each cache entry is a directory of .npy arrays that are memory-mapped when
+the entry is loaded, plus a small JSON file with the document names and the
+string table of the mention words and minimum spans:
+
+    clusters.npy      first cluster of each document (n_docs + 1)
+    mentions.npy      first mention of each cluster (n_clusters + 1)
+    spans.npy         (sent_num, start, end) of each mention
+    words.npy         first word of each mention (n_mentions + 1)
+    word_ids.npy      string ids of the mention words
+    min_spans.npy     first minimum span of each mention (n_mentions + 1)
+    min_span_ids.npy  (string id, index) of the minimum spans
+    stats.npy         removed singletons and nested mentions of each document
+
+Entries are evicted in least recently used order once the cache grows
+beyond `max_size` bytes.
+"""
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+from collections import Counter
+import numpy as np
+from coval.conll import mention
+
+CACHE_VERSION = 1
+STATS = ['key_singletons_num', 'key_nested_coref_num',
+        'key_removed_nested_clusters']
+ARRAYS = ['clusters', 'mentions', 'spans', 'words', 'word_ids', 'min_spans',
+        'min_span_ids', 'stats']
+
+
+def get_file_hash(file_name):
+    sha = hashlib.sha256()
+    with open(file_name, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+class KeyCache:
+    def __init__(self, cache_dir, max_size=1 << 30):
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def get_entry_name(self, key_file, NP_only, remove_nested,
+            keep_singletons, min_span):
+        options = 'v%d NP_only=%d remove_nested=%d keep_singletons=%d ' \
+                'min_span=%d' % (CACHE_VERSION, NP_only, remove_nested,
+                keep_singletons, min_span)
+        return hashlib.sha256(('%s %s' % (get_file_hash(key_file),
+                options)).encode('utf-8')).hexdigest()
+
+    def load(self, key_file, NP_only=False, remove_nested=False,
+            keep_singletons=True, min_span=False):
+        """Returns the CachedKey of `key_file` or None if it is not
+        cached with these options."""
+        entry_dir = os.path.join(self.cache_dir, self.get_entry_name(
+                key_file, NP_only, remove_nested, keep_singletons, min_span))
+        if not os.path.isdir(entry_dir):
+            return None
+
+        try:
+            cached_key = CachedKey(entry_dir)
+        except (OSError, ValueError) as err:
+            print('Ignoring the broken key cache entry %s: %s'
+                    % (entry_dir, err))
+            shutil.rmtree(entry_dir, ignore_errors=True)
+            return None
+
+        # The modification time of an entry is its last access for eviction
+        os.utime(entry_dir)
+        return cached_key
+
+    def builder(self, key_file, NP_only=False, remove_nested=False,
+            keep_singletons=True, min_span=False):
+        return CachedKeyBuilder(self, self.get_entry_name(key_file, NP_only,
+                remove_nested, keep_singletons, min_span))
+
+    def evict(self, keep=None):
+        """Removes the least recently used entries, except `keep`, until
+        the cache is not larger than max_size."""
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            entry_dir = os.path.join(self.cache_dir, name)
+            if not os.path.isdir(entry_dir) or name.startswith('.'):
+                continue
+            size = sum(os.path.getsize(os.path.join(entry_dir, f))
+                    for f in os.listdir(entry_dir))
+            entries.append((os.path.getmtime(entry_dir), name, size))
+
+        total_size = sum(size for _, _, size in entries)
+        for _, name, size in sorted(entries):
+            if total_size <= self.max_size:
+                break
+            if name == keep:
+                continue
+            shutil.rmtree(os.path.join(self.cache_dir, name),
+                    ignore_errors=True)
+            total_size -= size
+
+
+class CachedKey:
+    """Key clusters of one cache entry.  The arrays are memory-mapped and
+    the Mention objects of a document are only created by get_doc."""
+
+    def __init__(self, entry_dir):
+        with open(os.path.join(entry_dir, 'strings.json')) as f:
+            meta = json.load(f)
+        self.docs = meta['docs']
+        self.strings = meta['strings']
+        self.doc_index = {doc: i for i, doc in enumerate(self.docs)}
+
+        for name in ARRAYS:
+            setattr(self, name, np.load(os.path.join(entry_dir,
+                    name + '.npy'), mmap_mode='r'))
+
+    def get_doc(self, doc):
+        """Returns the key clusters and the key stats of `doc`."""
+        i = self.doc_index[doc]
+        clusters = []
+
+        for c in range(self.clusters[i], self.clusters[i + 1]):
+            cluster = []
+            for m in range(self.mentions[c], self.mentions[c + 1]):
+                sent_num, start, end = self.spans[m].tolist()
+                words = [self.strings[w] for w in
+                        self.word_ids[self.words[m]:self.words[m + 1]]]
+                key_mention = mention.Mention(doc, sent_num, start, end,
+                        words)
+                key_mention.min_spans = set(
+                        (self.strings[w], index) for w, index in
+                        self.min_span_ids[
+                                self.min_spans[m]:self.min_spans[m + 1]
+                        ].tolist())
+                cluster.append(key_mention)
+            clusters.append(cluster)
+
+        return clusters, Counter(dict(zip(STATS, self.stats[i].tolist())))
+
+
+class CachedKeyBuilder:
+    """Collects the processed key clusters of each document and writes them
+    as a new entry of the KeyCache."""
+
+    def __init__(self, key_cache, entry_name):
+        self.key_cache = key_cache
+        self.entry_name = entry_name
+        self.docs = []
+        self.string_ids = {}
+        self.clusters = [0]
+        self.mentions = [0]
+        self.spans = []
+        self.words = [0]
+        self.word_ids = []
+        self.min_spans = [0]
+        self.min_span_ids = []
+        self.stats = []
+
+    def get_string_id(self, string):
+        if string not in self.string_ids:
+            self.string_ids[string] = len(self.string_ids)
+        return self.string_ids[string]
+
+    def add(self, doc, clusters, stats):
+        self.docs.append(doc)
+        self.stats.append([stats[name] for name in STATS])
+
+        for cluster in clusters:
+            for m in cluster:
+                self.spans.append((m.sent_num, m.start, m.end))
+                self.word_ids.extend(self.get_string_id(w) for w in m.words)
+                self.words.append(len(self.word_ids))
+                self.min_span_ids.extend(
+                        (self.get_string_id(w), index)
+                        for w, index in sorted(m.min_spans,
+                                key=lambda e: e[1]))
+                self.min_spans.append(len(self.min_span_ids))
+            self.mentions.append(len(self.spans))
+        self.clusters.append(len(self.mentions) - 1)
+
+    def save(self):
+        cache_dir = self.key_cache.cache_dir
+        entry_dir = os.path.join(cache_dir, self.entry_name)
+        tmp_dir = tempfile.mkdtemp(prefix='.tmp', dir=cache_dir)
+
+        try:
+            with open(os.path.join(tmp_dir, 'strings.json'), 'w') as f:
+                json.dump({'docs': self.docs, 'strings': sorted(
+                        self.string_ids, key=self.string_ids.get)}, f)
+
+            arrays = {
+                    'clusters': np.array(self.clusters, dtype=np.int64),
+                    'mentions': np.array(self.mentions, dtype=np.int64),
+                    'spans': np.array(self.spans,
+                            dtype=np.int32).reshape(-1, 3),
+                    'words': np.array(self.words, dtype=np.int64),
+                    'word_ids': np.array(self.word_ids, dtype=np.int32),
+                    'min_spans': np.array(self.min_spans, dtype=np.int64),
+                    'min_span_ids': np.array(self.min_span_ids,
+                            dtype=np.int32).reshape(-1, 2),
+                    'stats': np.array(self.stats,
+                            dtype=np.int64).reshape(-1, len(STATS))}
+            for name in ARRAYS:
+                np.save(os.path.join(tmp_dir, name + '.npy'), arrays[name])
+
+            os.rename(tmp_dir, entry_dir)
+        except OSError:
+            # Another process may have written the same entry in the meantime
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            if not os.path.isdir(entry_dir):
+                raise
+
+        self.key_cache.evict(keep=self.entry_name)
@@ -1,4 +1,5 @@
 import hashlib
+from collections import deque
 
 
 class Mention:
@@ -81,12 +82,12 @@ class Mention:
             return
         
         terminal_shortest_depth = float('inf')
-        queue = [(root, 0)]
+        queue = deque([(root, 0)])
 
         accepted_tags = None
     
         while queue:
-            node, depth = queue.pop(0)
+            node, depth = queue.popleft()
 
             if not accepted_tags:
                 if node.tag[0:2] in ['NP', 'NM']:
@@ -129,10 +130,10 @@ class Mention:
             return
 
         terminal_shortest_depth = float('inf')
-        queue = [(root, 0)]
+        queue = deque([(root, 0)])
 
         while queue:
-            node, depth = queue.pop(0)
+            node, depth = queue.popleft()
 
             if node.isTerminal and depth <= terminal_shortest_depth:
                 if self.is_a_valid_terminal_node(node.tag, node.pos):
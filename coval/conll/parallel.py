@@ -0,0 +1,119 @@
+"""Scoring CoNLL documents in parallel worker processes.
+
+Documents are independent, so chunks of documents are sent to a process
+pool.  Each worker builds the coref infos of its documents and returns only
+their per-document (p_num, p_den, r_num, r_den) counts.  The counts are
+folded into the Evaluators in the order of the key file, so the results are
+identical to the serial scoring.
+"""
+import os
+from collections import Counter, deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+from coval.conll import reader
+from coval.eval import evaluator
+
+
+def score_chunk(chunk, metrics, NP_only, remove_nested, keep_singletons,
+        min_span):
+    stats = Counter()
+    doc_counts = []
+
+    for doc, key_doc_lines, sys_doc_lines, key_clusters in chunk:
+        coref_info = reader.get_doc_coref_info(doc, key_doc_lines,
+                sys_doc_lines, NP_only, remove_nested, keep_singletons,
+                min_span, stats, key_clusters)
+        doc_counts.append((doc, evaluator.get_metrics_counts(coref_info,
+                metrics)))
+
+    return doc_counts, stats
+
+
+def iter_document_counts(key_file, sys_file, metrics, NP_only=False,
+        remove_nested=False, keep_singletons=True, min_span=False, jobs=None,
+        chunk_size=16, key_cache=None):
+    """Yields (doc, counts) for every document of the key file, in order,
+    where counts holds the (p_num, p_den, r_num, r_den) of each metric.
+
+    At most 2 * jobs chunks are read ahead of the scored documents.  The
+    key clusters are taken from `key_cache`, in which the key file is first
+    stored if it is not cached yet.
+    """
+    jobs = jobs or os.cpu_count() or 1
+    stats = Counter()
+
+    cached_key = None
+    if key_cache:
+        cached_key = key_cache.load(key_file, NP_only, remove_nested,
+                keep_singletons, min_span) or build_cached_key(key_cache,
+                key_file, NP_only, remove_nested, keep_singletons, min_span)
+    if cached_key:
+        docs = iter_cached_key_docs(reader.iter_cached_key_doc_lines(
+                cached_key, key_file, sys_file, NP_only, min_span), stats)
+    else:
+        docs = ((doc, key_doc_lines, sys_doc_lines, None)
+                for doc, key_doc_lines, sys_doc_lines in
+                reader.iter_aligned_doc_lines(key_file, sys_file))
+
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        pending = deque()
+
+        while True:
+            while len(pending) < 2 * jobs:
+                chunk = list(islice(docs, chunk_size))
+                if not chunk:
+                    break
+                pending.append(executor.submit(score_chunk, chunk,
+                        [metric for _, metric in metrics], NP_only,
+                        remove_nested, keep_singletons, min_span))
+
+            if not pending:
+                break
+
+            doc_counts, chunk_stats = pending.popleft().result()
+            stats.update(chunk_stats)
+            for doc, counts in doc_counts:
+                yield doc, counts
+
+    reader.print_coref_stats(stats, remove_nested, keep_singletons, min_span)
+
+
+def build_cached_key(key_cache, key_file, NP_only, remove_nested,
+        keep_singletons, min_span):
+    """Processes the key file, stores its clusters in `key_cache` and
+    returns the new CachedKey."""
+    options = (NP_only, remove_nested, keep_singletons, min_span)
+    key_builder = key_cache.builder(key_file, *options)
+    for doc, key_doc_lines in reader.iter_doc_lines(key_file):
+        key_stats = Counter()
+        parse_trees = reader.AnnotatedParseTrees(key_doc_lines) if (
+                NP_only or min_span) else None
+        key_builder.add(doc, reader.get_doc_clusters(doc, key_doc_lines,
+                key_doc_lines, *options, stats=key_stats, side='key',
+                parse_trees=parse_trees), key_stats)
+    key_builder.save()
+    return key_cache.load(key_file, *options)
+
+
+def iter_cached_key_docs(docs, stats):
+    for (doc, key_doc_lines, sys_doc_lines, key_clusters,
+            key_stats) in docs:
+        stats.update(key_stats)
+        yield doc, key_doc_lines, sys_doc_lines, key_clusters
+
+
+def evaluate_documents(key_file, sys_file, metrics, NP_only=False,
+        remove_nested=False, keep_singletons=True, min_span=False, jobs=None,
+        beta=1, keep_aggregated_values=False, key_cache=None):
+    """Returns one Evaluator for each (name, metric) of `metrics`."""
+    evaluators = [evaluator.Evaluator(metric, beta=beta,
+            keep_aggregated_values=keep_aggregated_values)
+            for _, metric in metrics]
+
+    for _, counts in iter_document_counts(key_file, sys_file, metrics,
+            NP_only, remove_nested, keep_singletons, min_span, jobs,
+            key_cache=key_cache):
+        for e, doc_counts in zip(evaluators, counts):
+            e.add_counts(*doc_counts)
+
+    return evaluators
@@ -0,0 +1,70 @@
+"""Parser backends for key files without gold parse trees.
+
+A backend parses a batch of tokenized sentences in one call and returns one
+bracketed parse string per sentence, e.g. '(ROOT (NP (NNP John)))'.
+util.parse_key_file converts these strings into the POS and parse columns
+of the CoNLL format.
+"""
+from abc import ABC, abstractmethod
+
+
+class ParserBackend(ABC):
+    # Identifies the parses of the backend in the parse cache
+    name = None
+
+    @abstractmethod
+    def parse_sents(self, sentences):
+        """Returns the parse string of each of `sentences`, which are lists
+        of words."""
+
+
+class StanfordParserBackend(ParserBackend):
+    """The Stanford parser through nltk.  The Java parser is only started
+    by the first call of parse_sents."""
+    name = 'stanford-englishPCFG'
+
+    def __init__(self,
+            model_path='edu/stanford/nlp/models/lexparser/englishPCFG.ser.gz',
+            java_options='-Xmx8G'):
+        self.model_path = model_path
+        self.java_options = java_options
+        self.parser = None
+
+    def parse_sents(self, sentences):
+        if self.parser is None:
+            try:
+                from nltk.parse.stanford import StanfordParser
+                self.parser = StanfordParser(model_path=self.model_path,
+                        java_options=self.java_options)
+            # nltk raises LookupError if it does not find the parser jars
+            except (ImportError, LookupError):
+                print("You need to set the CLASSPATH environment variable "
+                        "to point to the Stanford parser!")
+                print("Example: export CLASSPATH=/path/to/"
+                        "stanford-parser-full-YYYY-MM-DD/"
+                        "stanford-parser.jar:/path/to/"
+                        "stanford-parser-full-YYYY-MM-DD/"
+                        "stanford-parser-X.X.X-models.jar")
+                print("")
+                raise
+
+        return [' '.join(str(next(iter(trees))).split())
+                for trees in self.parser.parse_sents(sentences)]
+
+
+class StubParserBackend(ParserBackend):
+    """Parses every sentence as a single flat NP.  It does not need Java and
+    is meant for testing."""
+    name = 'stub'
+
+    def __init__(self):
+        self.parsed_sents_num = 0
+
+    def parse_sents(self, sentences):
+        self.parsed_sents_num += len(sentences)
+        return ['(ROOT (NP %s))' % ' '.join('(NN %s)' % escape_word(w)
+                for w in sentence) for sentence in sentences]
+
+
+def escape_word(word):
+    return word.replace('(', '-LRB-').replace(')', '-RRB-')
@@ -1,4 +1,8 @@
+import re
 import sys
+from bisect import bisect_left, insort
+from collections import Counter
+from itertools import islice
 from coval.conll import mention
 
 
@@ -11,12 +15,13 @@ def get_doc_mentions(doc_name, doc_lines, keep_singletons,
     for sent_num, sent_line in enumerate(doc_lines):
         sent_words = []
         for word_index, line in enumerate(sent_line):
+            columns = line.split()
 
-            sent_words.append(line.split()[word_column]
-                    if len(line.split()) > word_column + 1 else '')
+            sent_words.append(columns[word_column]
+                    if len(columns) > word_column + 1 else '')
 
             single_token_coref, open_corefs, end_corefs = (
-                    extract_coref_annotation(line))
+                    get_coref_column_annotation(columns[-1]))
 
             if single_token_coref:
                 m = mention.Mention(doc_name, sent_num, word_index, word_index,
@@ -87,15 +92,65 @@ def mask_unseen_mentions(clusters, seen_mentions, keep_singletons):
     return [c for i, c in enumerate(clusters) if i not in remove_clusters]
 
 
+# Well-formed coref columns, e.g. '(12)', '(3|(7' or '7)', are '|'-separated
+# '(N)', '(N' and 'N)' tokens that can be read by a single regex
+COREF_COLUMN_RE = re.compile(r'(?:\(\d+\)?|\d+\))(?:\|(?:\(\d+\)?|\d+\)))*')
+COREF_TOKEN_RE = re.compile(r'\((\d+)\)|\((\d+)|(\d+)\)')
+MAX_COLUMN_CACHE_SIZE = 100000
+coref_column_cache = {'-': ((), (), ())}
+
+
 def extract_coref_annotation(line):
+    single_token_coref, open_corefs, ending_corefs = (
+            get_coref_column_annotation(line.split()[-1]))
+    return list(single_token_coref), list(open_corefs), list(ending_corefs)
+
+
+def get_coref_column_annotation(coref_column):
+    """Returns the (single_token_coref, open_corefs, ending_corefs) tuples
+    of a coref column.  The annotations are cached by the column string
+    since there are only few distinct values in a corpus."""
+    annotation = coref_column_cache.get(coref_column)
+    if annotation is None:
+        annotation = tokenize_coref_column(coref_column)
+        if len(coref_column_cache) < MAX_COLUMN_CACHE_SIZE:
+            coref_column_cache[coref_column] = annotation
+
+    if len(annotation[0]) > 1:
+        print('Warning: A single mention is assigned to more than one cluster: %s'
+                % list(annotation[0]))
+
+    return annotation
+
+
+def tokenize_coref_column(coref_column):
+    if COREF_COLUMN_RE.fullmatch(coref_column):
+        single_token_coref = []
+        open_corefs = []
+        ending_corefs = []
+        for single, opened, ending in COREF_TOKEN_RE.findall(coref_column):
+            if single:
+                single_token_coref.append(int(single))
+            elif opened:
+                open_corefs.append(int(opened))
+            else:
+                ending_corefs.append(int(ending))
+    else:
+        single_token_coref, open_corefs, ending_corefs = (
+                scan_coref_column(coref_column))
+
+    return tuple(single_token_coref), tuple(open_corefs), tuple(ending_corefs)
+
+
+def scan_coref_column(coref_column):
+    """Reads the coref column one character at a time.  It is only used
+    for the columns that are not matched by COREF_COLUMN_RE."""
     single_token_coref = []
     open_corefs = []
     ending_corefs = []
     last_num = []
     coref_opened = False
 
-    coref_column = line.split()[-1]
-
     for i, c in enumerate(coref_column):
         if c.isdigit():
             last_num.append(c)
@@ -126,16 +181,47 @@ def extract_coref_annotation(line):
             if coref_opened and len(last_num) > 0:
                 open_corefs.append(int(''.join(last_num)))
 
-    if len(single_token_coref) > 1:
-        print('Warning: A single mention is assigned to more than one cluster: %s'
-                % single_token_coref)
-
     return single_token_coref, open_corefs, ending_corefs
 
 
 def extract_annotated_parse(mention_lines, start_index,
         parse_column=5, word_column=3, POS_column=4):
     """Extracting gold parse annotation according to the CoNLL format."""
+    return build_annotated_parse([line.split() for line in mention_lines],
+            start_index, parse_column, word_column, POS_column)
+
+
+parse_events_cache = {}
+
+
+def get_parse_events(parse):
+    """Splits a parse column, e.g. '(TOP(S(NP-SBJ*', into its brackets,
+    stars and the alphabetic characters of its tags, i.e. '(', 'TOP', '(',
+    'S', '(', 'NPSBJ', '*'.  The events are cached by the column string."""
+    events = parse_events_cache.get(parse)
+    if events is None:
+        events = []
+        tag_name = []
+        for c in parse:
+            if c.isalpha():
+                tag_name.append(c)
+            elif c in '(*)':
+                if tag_name:
+                    events.append(''.join(tag_name))
+                    tag_name = []
+                events.append(c)
+        if tag_name:
+            events.append(''.join(tag_name))
+        events = tuple(events)
+        if len(parse_events_cache) < MAX_COLUMN_CACHE_SIZE:
+            parse_events_cache[parse] = events
+    return events
+
+
+def build_annotated_parse(mention_columns, start_index,
+        parse_column=5, word_column=3, POS_column=4):
+    """Same as extract_annotated_parse for the already split columns of
+    the mention lines."""
     open_nodes = []
     tag_started = False
     tag_name = []
@@ -144,9 +230,8 @@ def extract_annotated_parse(mention_lines, start_index,
     root = None
     roots = []
 
-    for i, line in enumerate(mention_lines):
-        parse = line.split()[parse_column]
-        for j, c in enumerate(parse):
+    for i, columns in enumerate(mention_columns):
+        for c in get_parse_events(columns[parse_column]):
             if c == '(':
                 if tag_started:
                     node = mention.TreeNode(''.join(tag_name), pos_tags, 
@@ -179,8 +264,8 @@ def extract_annotated_parse(mention_lines, start_index,
                 tag_started = True
 
             elif c == '*':
-                terminal_nodes.append(line.split()[word_column])
-                pos_tags.append(line.split()[POS_column])
+                terminal_nodes.append(columns[word_column])
+                pos_tags.append(columns[POS_column])
                 node = mention.TreeNode(''.join(tag_name), None,  
                         start_index+i, False)
 
@@ -220,23 +305,22 @@ def extract_annotated_parse(mention_lines, start_index,
 
                 tag_started = False
 
-            elif c.isalpha():
+            else:
                 tag_name.append(c)
 
-            if (i == len(mention_lines) - 1 and 
-                    j == len(parse) - 1 and terminal_nodes):
-                node = mention.TreeNode(' '.join(terminal_nodes),
-                        pos_tags, start_index + i, True)
-                if open_nodes:
-                    if open_nodes[-1].children:
-                        open_nodes[-1].children.append(node)
-                    else:
-                        open_nodes[-1].children = [node]
+        if i == len(mention_columns) - 1 and terminal_nodes:
+            node = mention.TreeNode(' '.join(terminal_nodes),
+                    pos_tags, start_index + i, True)
+            if open_nodes:
+                if open_nodes[-1].children:
+                    open_nodes[-1].children.append(node)
                 else:
-                    open_nodes.append(node)
+                    open_nodes[-1].children = [node]
+            else:
+                open_nodes.append(node)
 
-                terminal_nodes = []
-                pos_tags = []
+            terminal_nodes = []
+            pos_tags = []
 
     # If there is parsing errors in which starting phrasea are not ended at
     # the end of detected mention boundaries
@@ -255,18 +339,75 @@ def extract_annotated_parse(mention_lines, start_index,
 
 
 
+class AnnotatedParseTrees:
+    """Gold parse trees of the mention spans of a document.
+
+    The columns of each sentence are split only once, and the tree of each
+    (sent_num, start, end) span is built only once and shared by all the
+    key and system mentions with that span.  The same holds for minimum
+    spans, which only depend on the tree and the words of a mention.
+    """
+
+    def __init__(self, doc_lines):
+        self.doc_lines = doc_lines
+        self.sentence_columns = {}
+        self.trees = {}
+        self.min_spans = {}
+
+    def get_tree(self, sent_num, start, end):
+        span = (sent_num, start, end)
+        if span not in self.trees:
+            if sent_num not in self.sentence_columns:
+                self.sentence_columns[sent_num] = [
+                        line.split() for line in self.doc_lines[sent_num]]
+            self.trees[span] = build_annotated_parse(
+                    self.sentence_columns[sent_num][start:end + 1], start)
+        return self.trees[span]
+
+    def set_min_span(self, m):
+        """Sets the minimum span of `m`, whose gold parse is the tree of its
+        span.  Returns True if the minimum span of a previous mention with
+        the same span and words is reused."""
+        span = (m.sent_num, m.start, m.end, tuple(m.words))
+        min_spans = self.min_spans.get(span)
+        if min_spans is None:
+            m.set_min_span()
+            self.min_spans[span] = frozenset(m.min_spans)
+            return False
+
+        m.min_spans = set(min_spans)
+        return True
+
+    def add_min_spans(self, clusters):
+        """Makes the minimum spans of already processed mentions, e.g. key
+        mentions read from a KeyCache, available to set_min_span."""
+        for c in clusters:
+            for m in c:
+                self.min_spans.setdefault((m.sent_num, m.start, m.end,
+                        tuple(m.words)), frozenset(m.min_spans))
+
+
 def set_annotated_parse_trees(clusters, key_doc_lines, NP_only, min_span,
-        partial_vp_chain_pruning=True, print_debug=False):
+        partial_vp_chain_pruning=True, print_debug=False, parse_trees=None,
+        stats=None):
+    """Sets the gold parse, and the minimum span if `min_span` is set, of
+    all mentions.  The numbers of minimum spans that are reused from, or
+    added to, `parse_trees` are counted in `stats`."""
     pruned_cluster_indices = set()
     pruned_clusters = {}
+    if parse_trees is None:
+        parse_trees = AnnotatedParseTrees(key_doc_lines)
+    if stats is None:
+        stats = Counter()
 
     for i, c in enumerate(clusters):
         pruned_cluster = list(c)
         for m in c:
+            has_parse = True
             try:
-                tree = extract_annotated_parse(
-                        key_doc_lines[m.sent_num][m.start:m.end + 1], m.start)
+                tree = parse_trees.get_tree(m.sent_num, m.start, m.end)
             except IndexError as err:
+                has_parse = False
                 print(err, len(key_doc_lines), m.sent_num)
 
             m.set_gold_parse(tree)
@@ -281,7 +422,13 @@ def set_annotated_parse_trees(clusters, key_doc_lines, NP_only, min_span,
                         m.words.append(w)
 
             if min_span:
-                m.set_min_span()
+                # The tree of the previous mention is kept after an error
+                if not has_parse:
+                    m.set_min_span()
+                elif parse_trees.set_min_span(m):
+                    stats['min_span_hits'] += 1
+                else:
+                    stats['min_span_misses'] += 1
             if tree and tree.tag == 'VP' and NP_only:
                 pruned_cluster.remove(m)
                 pruned_cluster_indices.add(i)
@@ -331,6 +478,107 @@ def get_doc_lines(file_name):
     return doc_lines
 
 
+def iter_doc_lines(file_name):
+    """Yields the (doc_name, sentences) of a CoNLL file one document at a
+    time.  `file_name` can be '-' to read from the standard input."""
+    if file_name == '-':
+        yield from _iter_doc_lines(sys.stdin)
+    else:
+        with open(file_name) as f:
+            yield from _iter_doc_lines(f)
+
+
+def _iter_doc_lines(f):
+    doc_name = None
+    sentences = None
+    new_sentence = True
+
+    for line in f:
+        if line.startswith("#begin document"):
+            if doc_name and sentences:
+                yield doc_name, sentences
+            doc_name = line[len("#begin document "):]
+            sentences = []
+        elif line.startswith("#end document"):
+            if doc_name and sentences:
+                yield doc_name, sentences
+            doc_name = None
+            sentences = None
+
+        elif doc_name:
+            if (not line.strip() and not new_sentence) or not sentences:
+                sentences.append([])
+
+            if line.strip():
+                new_sentence = False
+                sentences[-1].append(line)
+            else:
+                new_sentence = True
+
+    # The last document is not closed by '#end document'
+    if doc_name and sentences:
+        yield doc_name, sentences
+
+
+def iter_aligned_doc_lines(key_file, sys_file):
+    """Walks the key and system files together and yields
+    (doc, key_sentences, sys_sentences) for every document of the key file.
+
+    Only one document per file is kept in memory as long as both files list
+    the documents in the same order.  System documents that come out of
+    order are buffered until the key file reaches them.
+    """
+    return align_doc_lines(iter_doc_lines(key_file), sys_file)
+
+
+def align_doc_lines(key_docs, sys_file):
+    """Same as iter_aligned_doc_lines for an iterable of (doc, key_item)
+    pairs instead of a key file."""
+    sys_docs = iter_doc_lines(sys_file)
+    pending_sys_docs = {}
+
+    for doc, key_item in key_docs:
+        while doc not in pending_sys_docs:
+            sys_doc, sys_sentences = next(sys_docs, (None, None))
+            if sys_doc is None:
+                raise KeyError('The document %r does not exist in the system '
+                        'output.' % doc)
+            pending_sys_docs[sys_doc] = sys_sentences
+
+        yield doc, key_item, pending_sys_docs.pop(doc)
+
+
+def get_containing_pairs(mentions):
+    """Returns the (i, j) index pairs, i < j, of the mentions of the same
+    sentence in which one mention span contains the other.
+
+    The mentions are swept in (sent_num, start, -end) order, so only the
+    previous mentions that are still open at the start of a mention can
+    contain it.  The open mentions are kept sorted by their ends: the
+    closed ones are a prefix and those that contain the mention a suffix,
+    which are both found by binary search.  The sweep therefore takes
+    O(n log n) comparisons plus one step per returned pair.
+    """
+    order = sorted(range(len(mentions)), key=lambda i: (mentions[i].sent_num,
+            mentions[i].start, -mentions[i].end, i))
+    pairs = []
+    # The (end, index) of the open mentions, sorted
+    open_mentions = []
+    sent_num = None
+
+    for j in order:
+        m = mentions[j]
+        if m.sent_num != sent_num:
+            sent_num = m.sent_num
+            open_mentions = []
+        del open_mentions[:bisect_left(open_mentions, (m.start, -1))]
+        for _, i in open_mentions[bisect_left(open_mentions, (m.end, -1)):]:
+            pairs.append((min(i, j), max(i, j)))
+        insort(open_mentions, (m.end, j))
+
+    return pairs
+
+
 def remove_nested_coref_mentions(clusters, keep_singletons, print_debug=False):
     to_be_removed_mentions = {}
     to_be_removed_clusters = []
@@ -340,17 +588,21 @@ def remove_nested_coref_mentions(clusters, keep_singletons, print_debug=False):
     for c_index, c in enumerate(clusters):
         to_be_removed_mentions[c_index] = []
 
-        for i, m1 in enumerate(c):
-            for m2 in c[i+1:]:
-                nested = m1.are_nested(m2)
-                # m1 is nested in m2
-                if nested == 0:
-                    to_be_removed_mentions[c_index].append(m1)
+        # Mention.are_nested decides about each candidate pair since
+        # mentions with equal minimum spans are not considered as nested
+        for i, j in sorted(get_containing_pairs(c)):
+            m1, m2 = c[i], c[j]
+            nested = m1.are_nested(m2)
+            # m1 is nested in m2
+            if nested == 0:
+                to_be_removed_mentions[c_index].append(m1)
+                if print_debug:
                     print(m1, m2)
                     print('=========================')
-                # m2 is nested in m1
-                elif nested == 1:
-                    to_be_removed_mentions[c_index].append(m2)
+            # m2 is nested in m1
+            elif nested == 1:
+                to_be_removed_mentions[c_index].append(m2)
+                if print_debug:
                     print(m2)
 
     for c_index in to_be_removed_mentions:
@@ -365,10 +617,15 @@ def remove_nested_coref_mentions(clusters, keep_singletons, print_debug=False):
 
             if not keep_singletons:
                 to_be_removed_clusters.append(c_index)
-        else:
+        elif to_be_removed_mentions[c_index]:
+            removed_mentions = to_be_removed_mentions[c_index]
+            # Mention hashes agree with Mention.__eq__ unless only some of
+            # the mentions have minimum spans
+            if len(set(bool(m.min_spans) for m in clusters[c_index])) == 1:
+                removed_mentions = set(removed_mentions)
             clusters[c_index] = [
                     m for m in clusters[c_index]
-                    if m not in to_be_removed_mentions[c_index]
+                    if m not in removed_mentions
             ]
 
     for c_index in sorted(to_be_removed_clusters, reverse=True):
@@ -383,80 +640,194 @@ def get_coref_infos(key_file,
         remove_nested=False,
         keep_singletons=True,
         min_span=False):
+    return dict(iter_coref_infos(key_file, sys_file, NP_only, remove_nested,
+            keep_singletons, min_span))
 
-    key_doc_lines = get_doc_lines(key_file)
-    sys_doc_lines = get_doc_lines(sys_file)
-
-    doc_coref_infos = {}
-
-    key_nested_coref_num = 0
-    sys_nested_coref_num = 0
-    key_removed_nested_clusters = 0
-    sys_removed_nested_clusters = 0
-    key_singletons_num = 0
-    sys_singletons_num = 0
-
-    for doc in key_doc_lines:
-
-        key_clusters, singletons_num = get_doc_mentions(
-                doc, key_doc_lines[doc], keep_singletons)
-        key_singletons_num += singletons_num
 
-        if NP_only or min_span:
-            key_clusters = set_annotated_parse_trees(key_clusters,
-                    key_doc_lines[doc],
-                    NP_only, min_span)
-
-        sys_clusters, singletons_num = get_doc_mentions(
-                doc, sys_doc_lines[doc], keep_singletons)
-        sys_singletons_num += singletons_num
-
-        if NP_only or min_span:
-            sys_clusters = set_annotated_parse_trees(sys_clusters,
-                    key_doc_lines[doc],
-                    NP_only, min_span)
-
-        if remove_nested:
-            nested_mentions, removed_clusters = remove_nested_coref_mentions(
-                    key_clusters, keep_singletons)
-            key_nested_coref_num += nested_mentions
-            key_removed_nested_clusters += removed_clusters
+def iter_coref_infos(key_file,
+        sys_file,
+        NP_only=False,
+        remove_nested=False,
+        keep_singletons=True,
+        min_span=False,
+        key_cache=None,
+        shard=None):
+    """Yields (doc, coref_info) as soon as each document of the key and
+    system files is read, so that only one document is kept in memory.
+
+    If a `key_cache` is given, the processed key clusters are read from it,
+    or are stored in it if the key file is not cached with these options.
+    With shard=(index, shards_num), only the index-th of shards_num
+    consecutive ranges of the key documents are processed.
+    """
+    stats = Counter()
+    options = (NP_only, remove_nested, keep_singletons, min_span)
+
+    cached_key = key_cache.load(key_file, *options) if key_cache else None
+    if shard:
+        docs_num = len(cached_key.docs) if cached_key else sum(
+                1 for _ in iter_doc_lines(key_file))
+        start, end = get_shard_range(docs_num, *shard)
+    else:
+        start, end = 0, None
+
+    if cached_key:
+        for (doc, key_doc_lines, sys_doc_lines, key_clusters,
+                key_stats) in islice(iter_cached_key_doc_lines(cached_key,
+                key_file, sys_file, NP_only, min_span), start, end):
+            stats.update(key_stats)
+            yield doc, get_doc_coref_info(doc, key_doc_lines, sys_doc_lines,
+                    *options, stats=stats, key_clusters=key_clusters)
+
+    else:
+        # The cache entry of a key file has all of its documents
+        key_builder = key_cache.builder(key_file, *options) if (
+                key_cache and not shard) else None
+        for doc, key_doc_lines, sys_doc_lines in islice(
+                iter_aligned_doc_lines(key_file, sys_file), start, end):
+            key_stats = Counter()
+            parse_trees = AnnotatedParseTrees(key_doc_lines) if (
+                    NP_only or min_span) else None
+            key_clusters = get_doc_clusters(doc, key_doc_lines,
+                    key_doc_lines, *options, stats=key_stats, side='key',
+                    parse_trees=parse_trees)
+            stats.update(key_stats)
+            if key_builder:
+                key_builder.add(doc, key_clusters, key_stats)
+
+            yield doc, get_doc_coref_info(doc, key_doc_lines, sys_doc_lines,
+                    *options, stats=stats, key_clusters=key_clusters,
+                    parse_trees=parse_trees)
+
+        if key_builder:
+            key_builder.save()
+
+    print_coref_stats(stats, remove_nested, keep_singletons, min_span)
+
+
+def get_shard_range(docs_num, index, shards_num):
+    """Returns the (start, end) positions of the index-th of shards_num
+    consecutive ranges of `docs_num` documents."""
+    if not 0 <= index < shards_num:
+        raise ValueError('Invalid shard %d of %d' % (index, shards_num))
+    return (docs_num * index // shards_num,
+            docs_num * (index + 1) // shards_num)
+
+
+def iter_cached_key_doc_lines(cached_key, key_file, sys_file, NP_only,
+        min_span):
+    """Yields (doc, key_sentences, sys_sentences, key_clusters, key_stats)
+    with the key clusters of a CachedKey.  The key file is only read if its
+    parse trees are required for the system mentions."""
+    if NP_only or min_span:
+        key_docs = iter_doc_lines(key_file)
+    else:
+        key_docs = ((doc, None) for doc in cached_key.docs)
+
+    for doc, key_doc_lines, sys_doc_lines in align_doc_lines(key_docs,
+            sys_file):
+        key_clusters, key_stats = cached_key.get_doc(doc)
+        yield doc, key_doc_lines, sys_doc_lines, key_clusters, key_stats
+
+
+def get_doc_coref_info(doc, key_doc_lines, sys_doc_lines,
+        NP_only=False,
+        remove_nested=False,
+        keep_singletons=True,
+        min_span=False,
+        stats=None,
+        key_clusters=None,
+        key_mention_index=None,
+        parse_trees=None):
+    """Builds the coref info of a single document.  The numbers of removed
+    singletons and nested mentions are added to the `stats` Counter.
+
+    `key_clusters`, and optionally the get_mention_index of `key_clusters`,
+    can be given if the key side is already processed.
+    `parse_trees` can be the AnnotatedParseTrees of `key_doc_lines` that
+    were used for the key side.
+    """
+    if stats is None:
+        stats = Counter()
+    options = (NP_only, remove_nested, keep_singletons, min_span)
+
+    if parse_trees is None and (NP_only or min_span):
+        parse_trees = AnnotatedParseTrees(key_doc_lines)
+        if min_span and key_clusters is not None:
+            parse_trees.add_min_spans(key_clusters)
+
+    if key_clusters is None:
+        key_clusters = get_doc_clusters(doc, key_doc_lines, key_doc_lines,
+                *options, stats=stats, side='key', parse_trees=parse_trees)
+    sys_clusters = get_doc_clusters(doc, sys_doc_lines, key_doc_lines,
+            *options, stats=stats, side='sys', parse_trees=parse_trees)
+
+    key_mention_sys_cluster, sys_mention_key_cluster = \
+            get_bidirectional_mention_assignments(key_clusters,
+            sys_clusters, key_mention_index)
+
+    return (key_clusters, sys_clusters,
+            key_mention_sys_cluster, sys_mention_key_cluster)
+
+
+def get_doc_clusters(doc, doc_lines, key_doc_lines,
+        NP_only=False,
+        remove_nested=False,
+        keep_singletons=True,
+        min_span=False,
+        stats=None,
+        side='key',
+        parse_trees=None):
+    """Extracts the clusters of either the key or the system side of a
+    document.  The parse trees are always taken from `key_doc_lines`, or
+    from `parse_trees` that can be shared by both sides."""
+    if stats is None:
+        stats = Counter()
+
+    clusters, singletons_num = get_doc_mentions(
+            doc, doc_lines, keep_singletons)
+    stats[side + '_singletons_num'] += singletons_num
+
+    if NP_only or min_span:
+        clusters = set_annotated_parse_trees(clusters,
+                key_doc_lines,
+                NP_only, min_span, parse_trees=parse_trees, stats=stats)
 
-            nested_mentions, removed_clusters = remove_nested_coref_mentions(
-                    sys_clusters, keep_singletons)
-            sys_nested_coref_num += nested_mentions
-            sys_removed_nested_clusters += removed_clusters
+    if remove_nested:
+        nested_mentions, removed_clusters = remove_nested_coref_mentions(
+                clusters, keep_singletons)
+        stats[side + '_nested_coref_num'] += nested_mentions
+        stats[side + '_removed_nested_clusters'] += removed_clusters
 
-        sys_mention_key_cluster = get_mention_assignments(
-                sys_clusters, key_clusters)
-        key_mention_sys_cluster = get_mention_assignments(
-                key_clusters, sys_clusters)
+    return clusters
 
-        doc_coref_infos[doc] = (key_clusters, sys_clusters,
-                key_mention_sys_cluster, sys_mention_key_cluster)
 
+def print_coref_stats(stats, remove_nested, keep_singletons, min_span=False):
     if remove_nested:
         print('Number of removed nested coreferring mentions in the key '
                 'annotation: %s; and system annotation: %s' % (
-                key_nested_coref_num, sys_nested_coref_num))
+                stats['key_nested_coref_num'], stats['sys_nested_coref_num']))
         print('Number of resulting singleton clusters in the key '
                 'annotation: %s; and system annotation: %s' % (
-                key_removed_nested_clusters, sys_removed_nested_clusters))
+                stats['key_removed_nested_clusters'],
+                stats['sys_removed_nested_clusters']))
 
     if not keep_singletons:
         print('%d and %d singletons are removed from the key and system '
                 'files, respectively' % (
-                key_singletons_num, sys_singletons_num))
+                stats['key_singletons_num'], stats['sys_singletons_num']))
 
-    return doc_coref_infos
+    min_span_num = stats['min_span_hits'] + stats['min_span_misses']
+    if min_span and min_span_num:
+        print('%d of %d minimum spans (%.2f%%) are reused from mentions with '
+                'the same span' % (stats['min_span_hits'], min_span_num,
+                100.0 * stats['min_span_hits'] / min_span_num))
 
 
-def get_mention_assignments(inp_clusters, out_clusters):
+def get_mention_assignments(inp_clusters, out_clusters, out_dic=None):
     mention_cluster_ids = {}
-    out_dic = {}
-    for i, c in enumerate(out_clusters):
-        for m in c:
-            out_dic[m] = i
+    if out_dic is None:
+        out_dic = get_mention_cluster_ids(out_clusters)
 
     for ic in inp_clusters:
         for im in ic:
@@ -464,3 +835,95 @@ def get_mention_assignments(inp_clusters, out_clusters):
                 mention_cluster_ids[im] = out_dic[im]
 
     return mention_cluster_ids
+
+
+def get_mention_cluster_ids(clusters):
+    mention_cluster_ids = {}
+    for i, c in enumerate(clusters):
+        for m in c:
+            mention_cluster_ids[m] = i
+
+    return mention_cluster_ids
+
+
+def get_mention_identity(m):
+    """Returns a hashable value that is equal for two mentions of the same
+    document iff the mentions are equal, provided that either both or none
+    of them have minimum spans."""
+    if m.min_spans:
+        return m.sent_num, frozenset(m.min_spans)
+    return m.sent_num, m.start, m.end
+
+
+def get_mention_index(clusters):
+    """Maps the identity of each distinct mention of `clusters` to
+    [mention, cluster id], where mention is its first Mention object and
+    cluster id is its last cluster, as in get_mention_cluster_ids.
+
+    Returns None if only some of the mentions have minimum spans.  Mention
+    equality is not symmetric for such mentions, so they cannot be indexed
+    by their identity."""
+    index = {}
+    with_min_spans = without_min_spans = False
+
+    for i, c in enumerate(clusters):
+        for m in c:
+            if m.min_spans:
+                with_min_spans = True
+            else:
+                without_min_spans = True
+            identity = get_mention_identity(m)
+            entry = index.get(identity)
+            if entry is None:
+                index[identity] = [m, i]
+            else:
+                entry[1] = i
+
+    if with_min_spans and without_min_spans:
+        return None
+    return index
+
+
+def get_mention_indexes(key_clusters, sys_clusters, key_mention_index=None):
+    """Returns the get_mention_index of both sides, or (None, None) if
+    their mentions cannot be matched by identity."""
+    if key_mention_index is None:
+        key_mention_index = get_mention_index(key_clusters)
+    sys_mention_index = get_mention_index(sys_clusters)
+    if key_mention_index is None or sys_mention_index is None:
+        return None, None
+
+    # Both sides must agree on whether their mentions have minimum spans
+    if key_mention_index and sys_mention_index and (
+            len(next(iter(key_mention_index)))
+            != len(next(iter(sys_mention_index)))):
+        return None, None
+
+    return key_mention_index, sys_mention_index
+
+
+def get_bidirectional_mention_assignments(key_clusters, sys_clusters,
+        key_mention_index=None):
+    """Returns (key_mention_sys_cluster, sys_mention_key_cluster), i.e.
+    get_mention_assignments in both directions, from a single pass over the
+    mentions of each side.  Every mention is looked up by its identity, so
+    Mention.__hash__ is only computed for the mentions of the results."""
+    key_mention_index, sys_mention_index = get_mention_indexes(key_clusters,
+            sys_clusters, key_mention_index)
+    if key_mention_index is None:
+        return (get_mention_assignments(key_clusters, sys_clusters),
+                get_mention_assignments(sys_clusters, key_clusters))
+
+    key_mention_sys_cluster = {}
+    for identity, (m, _) in key_mention_index.items():
+        sys_entry = sys_mention_index.get(identity)
+        if sys_entry is not None:
+            key_mention_sys_cluster[m] = sys_entry[1]
+
+    sys_mention_key_cluster = {}
+    for identity, (m, _) in sys_mention_index.items():
+        key_entry = key_mention_index.get(identity)
+        if key_entry is not None:
+            sys_mention_key_cluster[m] = key_entry[1]
+
+    return key_mention_sys_cluster, sys_mention_key_cluster
@@ -0,0 +1,174 @@
+"""Persistent store of the per-document counts of the metrics.
+
+Consecutive outputs of a system, e.g. the checkpoints of a model, usually
+differ in only some of their documents.  A DocumentStore keeps the counts of
+each metric for every scored document in an SQLite database, keyed by a
+content hash of the key and system lines of the document and of the
+evaluation options.  Documents whose lines did not change are not processed
+again.
+
+The store also records which documents, and in which order, each system
+file contained when it was last scored.  The scores of any subset of these
+documents are then summed from the stored counts without reading the CoNLL
+files.
+"""
+import hashlib
+import json
+import os
+import sqlite3
+from collections import Counter
+from coval.conll import reader
+from coval.eval import evaluator
+
+STORE_VERSION = 1
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS counts (doc_hash TEXT, metric TEXT,
+        counts TEXT, PRIMARY KEY (doc_hash, metric));
+CREATE TABLE IF NOT EXISTS stats (doc_hash TEXT PRIMARY KEY, stats TEXT);
+CREATE TABLE IF NOT EXISTS runs (run TEXT, position INTEGER, doc TEXT,
+        doc_hash TEXT, PRIMARY KEY (run, doc));
+'''
+
+
+def get_doc_hash(key_doc_lines, sys_doc_lines, NP_only, remove_nested,
+        keep_singletons, min_span):
+    sha = hashlib.sha256(('v%d NP_only=%d remove_nested=%d '
+            'keep_singletons=%d min_span=%d\n' % (STORE_VERSION, NP_only,
+            remove_nested, keep_singletons, min_span)).encode('utf-8'))
+    for doc_lines in [key_doc_lines, sys_doc_lines]:
+        for sentence in doc_lines:
+            for line in sentence:
+                sha.update(line.encode('utf-8'))
+            sha.update(b'\n')
+        sha.update(b'\0')
+    return sha.hexdigest()
+
+
+class DocumentStore:
+    def __init__(self, path):
+        self.connection = sqlite3.connect(path)
+        self.connection.executescript(SCHEMA)
+
+    def close(self):
+        self.connection.close()
+
+    def get_counts(self, doc_hash, metrics):
+        """Returns the stored counts of each of `metrics`, which are None
+        for the metrics that are not stored, for the document `doc_hash`."""
+        stored = dict(self.connection.execute('SELECT metric, counts FROM '
+                'counts WHERE doc_hash = ?', (doc_hash,)))
+        return [tuple(json.loads(stored[metric.__name__]))
+                if metric.__name__ in stored else None
+                for metric in metrics]
+
+    def get_stats(self, doc_hash):
+        row = self.connection.execute('SELECT stats FROM stats WHERE '
+                'doc_hash = ?', (doc_hash,)).fetchone()
+        return Counter(json.loads(row[0])) if row else Counter()
+
+    def add_counts(self, doc_hash, metrics, counts, stats):
+        self.connection.executemany('INSERT OR REPLACE INTO counts VALUES '
+                '(?, ?, ?)', [(doc_hash, metric.__name__, json.dumps(
+                evaluator.get_json_values(metric_counts)))
+                for metric, metric_counts in zip(metrics, counts)])
+        self.connection.execute('INSERT OR REPLACE INTO stats VALUES (?, ?)',
+                (doc_hash, json.dumps(stats)))
+
+    def set_run_docs(self, run, docs):
+        """Records the (doc, doc_hash) of each document of the system file
+        `run`, in order."""
+        self.connection.execute('DELETE FROM runs WHERE run = ?', (run,))
+        self.connection.executemany('INSERT INTO runs VALUES (?, ?, ?, ?)',
+                [(run, position, doc, doc_hash)
+                for position, (doc, doc_hash) in enumerate(docs)])
+
+    def get_run_docs(self, run):
+        """Returns the (doc, doc_hash) of the documents of `run`, in
+        order."""
+        return self.connection.execute('SELECT doc, doc_hash FROM runs '
+                'WHERE run = ? ORDER BY position', (run,)).fetchall()
+
+    def commit(self):
+        self.connection.commit()
+
+
+def get_run_name(sys_file):
+    return os.path.abspath(sys_file)
+
+
+def evaluate(doc_store, key_file, sys_file, metrics, NP_only=False,
+        remove_nested=False, keep_singletons=True, min_span=False, beta=1,
+        keep_aggregated_values=False):
+    """Returns one Evaluator for each metric of `metrics`.  Only the
+    documents whose counts are not in `doc_store` are processed, and their
+    counts are added to it."""
+    options = (NP_only, remove_nested, keep_singletons, min_span)
+    evaluators = [evaluator.Evaluator(metric, beta=beta,
+            keep_aggregated_values=keep_aggregated_values)
+            for metric in metrics]
+    stats = Counter()
+    run_docs = []
+    stored_docs_num = 0
+
+    for doc, key_doc_lines, sys_doc_lines in reader.iter_aligned_doc_lines(
+            key_file, sys_file):
+        doc_hash = get_doc_hash(key_doc_lines, sys_doc_lines, *options)
+        counts = doc_store.get_counts(doc_hash, metrics)
+        missing_metrics = [metric for metric, metric_counts
+                in zip(metrics, counts) if metric_counts is None]
+
+        if missing_metrics:
+            doc_stats = Counter()
+            coref_info = reader.get_doc_coref_info(doc, key_doc_lines,
+                    sys_doc_lines, *options, stats=doc_stats)
+            missing_counts = evaluator.get_metrics_counts(coref_info,
+                    missing_metrics)
+            doc_store.add_counts(doc_hash, missing_metrics, missing_counts,
+                    doc_stats)
+            missing_counts = iter(missing_counts)
+            counts = [metric_counts if metric_counts is not None
+                    else next(missing_counts) for metric_counts in counts]
+        else:
+            doc_stats = doc_store.get_stats(doc_hash)
+            stored_docs_num += 1
+
+        stats.update(doc_stats)
+        for e, metric_counts in zip(evaluators, counts):
+            e.add_counts(*metric_counts)
+        run_docs.append((doc.strip(), doc_hash))
+
+    doc_store.set_run_docs(get_run_name(sys_file), run_docs)
+    doc_store.commit()
+
+    reader.print_coref_stats(stats, remove_nested, keep_singletons, min_span)
+    print('The counts of %d of %d documents are read from the document '
+            'store' % (stored_docs_num, len(run_docs)))
+    return evaluators
+
+
+def evaluate_subset(doc_store, sys_file, metrics, docs=None, beta=1):
+    """Returns one Evaluator for each metric of `metrics` for the
+    documents `docs`, or all the documents, of the last scoring of
+    `sys_file`.  Only the stored counts are used."""
+    run_docs = doc_store.get_run_docs(get_run_name(sys_file))
+    if not run_docs:
+        raise KeyError('%s is not scored in the document store' % sys_file)
+    if docs is not None:
+        docs = set(docs)
+        unknown_docs = docs - set(doc for doc, _ in run_docs)
+        if unknown_docs:
+            raise KeyError('The documents %s are not in %s'
+                    % (sorted(unknown_docs), sys_file))
+
+    evaluators = [evaluator.Evaluator(metric, beta=beta)
+            for metric in metrics]
+    for doc, doc_hash in run_docs:
+        if docs is not None and doc not in docs:
+            continue
+        counts = doc_store.get_counts(doc_hash, metrics)
+        if any(metric_counts is None for metric_counts in counts):
+            raise KeyError('Not all the metrics are stored for %s' % doc)
+        for e, metric_counts in zip(evaluators, counts):
+            e.add_counts(*metric_counts)
+    return evaluators
@@ -1,68 +1,185 @@
-def parse_key_file(key_file):
-        try:
-                from nltk.parse.stanford import StanfordParser
-                parser = StanfordParser(model_path="edu/stanford/nlp/models/lexparser/englishPCFG.ser.gz", java_options='-Xmx8G')
-                print("Starting to parse key_file!")
-                print("This might take a while...")
-                new_file = open(key_file + ".parsed","w")
-                with open(key_file) as f:
-                        tmp_sentence = [[]]
-                        tmp_conll_lines = []
-                        for line in f:
-                                if line.startswith("#begin"):
-                                        new_file.write(line)
-                                        continue
-                                elif len(line.strip()) == 0 or (line.startswith("#end") and len(tmp_conll_lines)>0):
-                                        parse = parser.parse_sents(tmp_sentence)
-                                        for tree in parse:
-                                                for tree_line in tree:       #line is a Tree
-                                                        parse_string = ' '.join(str(tree_line).split())
-                                                        treecomp = parse_string.split()
-                                                        currlowestindex = 0
-                                                        token_index = 0
-                                                        for idx, val in enumerate(treecomp):
-                                                                if not val.startswith("("):
-                                                                        firstindexofbracket = val.index(")")
-                                                                        lastindex = val.__len__() - 1
-                                                                        tag_components = []
-                                                                        pos_tag = treecomp[idx-1].replace("(", "")
-                                                                        if currlowestindex == idx - 1:
-                                                                                if firstindexofbracket == lastindex:
-                                                                                        tag_components.append("*")
-                                                                                else:
-                                                                                        parsecol = "*" + val[firstindexofbracket:lastindex]
-                                                                                        tag_components.append(parsecol)
-                                                                        else:
-                                                                                for i in range(currlowestindex, idx - 1):
-                                                                                        tag_components.append(treecomp[i])
-                                                                                if firstindexofbracket == lastindex:
-                                                                                        tag_components.append("*")
-                                                                                else:
-                                                                                        parsecol = "*" + val[firstindexofbracket:lastindex]
-                                                                                        tag_components.append(parsecol)
-                                                                        currlowestindex = idx + 1
-
-                                                                        new_file.write('\t'.join(tmp_conll_lines[token_index].split()[0:4])+ "\t" + pos_tag + "\t" + ''.join(tag_components) +'\t' +'\t'.join(tmp_conll_lines[token_index].split()[4:])+ '\n')
-                                                                        token_index += 1
-
-                                        tmp_sentence[0] = []
-                                        tmp_conll_lines = []
-                                        new_file.write("\n")
-
-                                elif not line.startswith("#"):
-                                        word = line.split()[3]
-                                        word_uc = word #.decode(encoding='UTF-8')
-                                        tmp_sentence[0].append(word_uc)
-                                        tmp_conll_lines.append(line)
-                                if line.startswith("#end"):
-                                        new_file.write(line)
-                                        
-
-        except:
-                print("You need to set the CLASSPATH environment variable to point to the Stanford parser!")
-                print("Example: export CLASSPATH=/path/to/stanford-parser-full-YYYY-MM-DD/stanford-parser.jar:/path/to/stanford-parser-full-YYYY-MM-DD/stanford-parser-X.X.X-models.jar")
-                print("")
-                raise
+import hashlib
+import os
+import shutil
+import tempfile
+from coval.conll import cache
+from coval.conll import parsing
+
+
+def parse_key_file(key_file, parser=None, batch_size=1000, cache_dir=None):
+    """Adds the POS and parse columns of `parser`, the Stanford parser by
+    default, to `key_file` and returns the name of the parsed file,
+    key_file + '.parsed'.
+
+    The parsed file is reused while it is up to date with the content of
+    `key_file`, which is recorded in key_file + '.parsed.source'.  With
+    `cache_dir`, the parsed files are also kept there by the hash of the
+    key content, so that a key is only parsed once across runs.  Parses are
+    checkpointed every `batch_size` sentences and an interrupted run
+    resumes from its last checkpoint.
+    """
+    if parser is None:
+        parser = parsing.StanfordParserBackend()
+    parsed_file = key_file + '.parsed'
+    source_file = parsed_file + '.source'
+    source = '%s %s' % (cache.get_file_hash(key_file), parser.name)
+
+    if os.path.isfile(parsed_file) and read_source(source_file) == source:
+        print('Using the parsed key file %s' % parsed_file)
+        return parsed_file
+
+    cache_file = os.path.join(cache_dir, hashlib.sha256(
+            source.encode('utf-8')).hexdigest() + '.parsed') if (
+            cache_dir) else None
+    if cache_file and os.path.isfile(cache_file):
+        print('Using the cached parse of %s' % key_file)
+        copy_file(cache_file, parsed_file)
+    else:
+        checkpoint_file = parsed_file + '.checkpoint'
+        parses = parse_sentences(key_file, parser, batch_size,
+                checkpoint_file, source)
+        write_parsed_file(key_file, parses, parsed_file)
+        if cache_file:
+            os.makedirs(cache_dir, exist_ok=True)
+            copy_file(parsed_file, cache_file)
+        os.remove(checkpoint_file)
+
+    with open(source_file, 'w') as f:
+        f.write(source + '\n')
+    return parsed_file
+
+
+def iter_key_file_layout(key_file):
+    """Yields the lines that are copied from `key_file` to the parsed file
+    and, as lists of CoNLL lines, the sentences that are parsed."""
+    with open(key_file) as f:
+        conll_lines = []
+        for line in f:
+            if line.startswith("#begin"):
+                yield line
+                continue
+            elif len(line.strip()) == 0 or (line.startswith("#end")
+                    and len(conll_lines) > 0):
+                if conll_lines:
+                    yield conll_lines
+                conll_lines = []
+                yield "\n"
+            elif not line.startswith("#"):
+                conll_lines.append(line)
+            if line.startswith("#end"):
+                yield line
+
+        if conll_lines:
+            yield conll_lines
+
+
+def parse_sentences(key_file, parser, batch_size, checkpoint_file, source):
+    """Returns the parse strings of all the sentences of `key_file`.  The
+    parses of a previous run of the same `source` are read from
+    `checkpoint_file` and only the remaining sentences are parsed."""
+    sentences = [[line.split()[3] for line in item]
+            for item in iter_key_file_layout(key_file)
+            if isinstance(item, list)]
+
+    parses = []
+    if os.path.isfile(checkpoint_file):
+        with open(checkpoint_file) as f:
+            if f.readline() == source + '\n':
+                # The last line is incomplete if the run was interrupted
+                parses = [line[:-1] for line in f if line.endswith('\n')]
+    parses = parses[:len(sentences)]
+
+    if parses:
+        print("Resuming from %d of %d parsed sentences"
+                % (len(parses), len(sentences)))
+    elif sentences:
+        print("Starting to parse key_file!")
+        print("This might take a while...")
+
+    with open(checkpoint_file, 'w') as f:
+        f.write(source + '\n')
+        f.write(''.join(parse + '\n' for parse in parses))
+        f.flush()
+        for i in range(len(parses), len(sentences), batch_size):
+            batch_parses = parser.parse_sents(sentences[i:i + batch_size])
+            f.write(''.join(parse + '\n' for parse in batch_parses))
+            f.flush()
+            parses.extend(batch_parses)
+
+    return parses
+
+
+def write_parsed_file(key_file, parses, parsed_file):
+    parses = iter(parses)
+    fd, tmp_file = tempfile.mkstemp(prefix='.tmp',
+            dir=os.path.dirname(os.path.abspath(parsed_file)))
+
+    with os.fdopen(fd, 'w') as new_file:
+        for item in iter_key_file_layout(key_file):
+            if not isinstance(item, list):
+                new_file.write(item)
+                continue
+
+            parse_columns = get_parse_columns(next(parses))
+            if len(parse_columns) != len(item):
+                raise ValueError('The parse of "%s" has %d instead of %d '
+                        'tokens' % (' '.join(line.split()[3]
+                        for line in item), len(parse_columns), len(item)))
+            for line, (pos_tag, parse_bit) in zip(item, parse_columns):
+                columns = line.split()
+                new_file.write('\t'.join(columns[0:4]) + "\t" + pos_tag
+                        + "\t" + parse_bit + '\t'
+                        + '\t'.join(columns[4:]) + '\n')
+
+    os.replace(tmp_file, parsed_file)
+
+
+def get_parse_columns(parse_string):
+    """Returns the (POS tag, CoNLL parse bit) of each token of a bracketed
+    parse string."""
+    treecomp = parse_string.split()
+    parse_columns = []
+    currlowestindex = 0
+
+    for idx, val in enumerate(treecomp):
+        if not val.startswith("("):
+            firstindexofbracket = val.index(")")
+            lastindex = len(val) - 1
+            tag_components = []
+            pos_tag = treecomp[idx - 1].replace("(", "")
+            if currlowestindex != idx - 1:
+                for i in range(currlowestindex, idx - 1):
+                    tag_components.append(treecomp[i])
+            if firstindexofbracket == lastindex:
+                tag_components.append("*")
+            else:
+                tag_components.append(
+                        "*" + val[firstindexofbracket:lastindex])
+            currlowestindex = idx + 1
+            parse_columns.append((pos_tag, ''.join(tag_components)))
+
+    return parse_columns
+
+
+def read_source(source_file):
+    if not os.path.isfile(source_file):
+        return None
+    with open(source_file) as f:
+        return f.read().strip()
+
+
+def copy_file(src, dst):
+    """Copies `src` so that `dst` is never seen partially written."""
+    fd, tmp_file = tempfile.mkstemp(prefix='.tmp',
+            dir=os.path.dirname(os.path.abspath(dst)))
+    os.close(fd)
+    try:
+        shutil.copyfile(src, tmp_file)
+        os.replace(tmp_file, dst)
+    except OSError:
+        os.remove(tmp_file)
+        raise
+
 
 def check_gold_parse_annotation(key_file):
     has_gold_parse = False
@@ -0,0 +1,128 @@
+"""Bootstrap confidence intervals from per-document counts.
+
+The documents are resampled with replacement through NumPy index
+matrices.  Each chunk of resamples is turned into a matrix of how many
+times every document is drawn, and one matrix product with the
+per-document counts of all the Evaluators gives the summed counts of every
+resample.  The same resamples are used for all metrics, so the CoNLL
+average is resampled consistently with its parts.
+"""
+import numpy as np
+from coval.eval import evaluator
+
+CONLL_METRICS = [evaluator.muc, evaluator.b_cubed, evaluator.ceafe]
+
+# The largest number of (resample, document) cells per chunk
+MAX_CHUNK_CELLS = 1 << 22
+
+
+def get_document_counts(evaluators):
+    """Returns the per-document counts of `evaluators`, which must keep
+    their aggregated values, as one (n_docs, n_counts) array."""
+    return np.column_stack([values for e in evaluators
+            for values in e.get_aggregated_arrays()])
+
+
+def iter_resampled_counts(doc_counts, n_resamples, seed=None):
+    """Yields the summed counts of chunks of bootstrap resamples of the
+    rows of `doc_counts`, as (chunk_size, n_counts) arrays."""
+    rng = np.random.default_rng(seed)
+    n_docs = len(doc_counts)
+    chunk_size = max(1, MAX_CHUNK_CELLS // max(n_docs, 1))
+
+    for start in range(0, n_resamples, chunk_size):
+        size = min(chunk_size, n_resamples - start)
+        indices = rng.integers(0, n_docs, size=(size, n_docs))
+        # How many times each document is drawn in each resample
+        weights = np.bincount((indices + n_docs * np.arange(size)[:, None]
+                ).ravel(), minlength=size * n_docs).reshape(size, n_docs)
+        yield weights @ doc_counts
+
+
+def get_array_scores(metric, counts, beta=1):
+    """Vectorized evaluator.get_scores for `counts` of shape
+    (n_counts, n)."""
+    if metric == evaluator.blanc:
+        coref_scores = get_array_count_scores(counts[:4], beta)
+        non_coref_scores = get_array_count_scores(counts[4:], beta)
+        return tuple(np.where(counts[3] == 0, n, np.where(counts[7] == 0,
+                c, (c + n) / 2.0)) for c, n in zip(coref_scores,
+                non_coref_scores))
+    return get_array_count_scores(counts, beta)
+
+
+def get_array_count_scores(counts, beta=1):
+    p_num, p_den, r_num, r_den = counts
+    recall = divide(r_num, r_den)
+    precision = divide(p_num, p_den)
+    f1 = divide((1 + beta * beta) * precision * recall,
+            beta * beta * precision + recall)
+    return recall, precision, f1
+
+
+def divide(num, den):
+    """num / den, which is 0 where den is 0."""
+    num, den = np.broadcast_arrays(np.asarray(num, dtype=float), den)
+    return np.divide(num, den, out=np.zeros(num.shape), where=den != 0)
+
+
+def get_counts_layout(evaluators):
+    """Returns the (metric, counts number, beta) of each of `evaluators`,
+    in the order of the columns of get_document_counts."""
+    return [(e.metric, len(e.get_counts()), e.beta) for e in evaluators]
+
+
+def get_layout_scores(layout, counts):
+    """Returns the (recall, precision, F1) arrays of each metric of
+    `layout` for the summed `counts` of shape (n, n_counts)."""
+    scores = []
+    offset = 0
+    for metric, counts_num, beta in layout:
+        scores.append(get_array_scores(metric,
+                counts[:, offset:offset + counts_num].T, beta))
+        offset += counts_num
+    return scores
+
+
+def resample_scores(evaluators, n_resamples=1000, seed=None):
+    """Returns the (recall, precision, F1) arrays of each of `evaluators`
+    over `n_resamples` bootstrap resamples of the documents."""
+    doc_counts = get_document_counts(evaluators)
+    return get_layout_scores(get_counts_layout(evaluators), np.vstack(list(
+            iter_resampled_counts(doc_counts, n_resamples, seed))))
+
+
+def get_conll_scores(evaluators, scores):
+    """Returns the resampled CoNLL scores, the average F1 of MUC, B-cubed
+    and CEAFe, or None if one of them is not evaluated."""
+    return get_layout_conll_scores(get_counts_layout(evaluators), scores)
+
+
+def get_layout_conll_scores(layout, scores):
+    f1s = {metric: f1 for (metric, _, _), (_, _, f1) in zip(layout, scores)}
+    if not all(metric in f1s for metric in CONLL_METRICS):
+        return None
+    return sum(f1s[metric] for metric in CONLL_METRICS) / 3
+
+
+def get_interval(values, confidence=0.95):
+    alpha = (1 - confidence) / 2
+    low, high = np.percentile(values, [100 * alpha, 100 * (1 - alpha)])
+    return low, high
+
+
+def get_confidence_intervals(evaluators, n_resamples=1000, confidence=0.95,
+        seed=None):
+    """Returns the percentile bootstrap intervals of the (recall,
+    precision, F1) of each of `evaluators`, and of the CoNLL score or None
+    if it is not evaluated.  The evaluators must keep their aggregated
+    values and be updated with the same documents."""
+    scores = resample_scores(evaluators, n_resamples, seed)
+    intervals = [tuple(get_interval(values, confidence) for values in
+            metric_scores) for metric_scores in scores]
+
+    conll_scores = get_conll_scores(evaluators, scores)
+    conll_interval = get_interval(conll_scores, confidence) if (
+            conll_scores is not None) else None
+
+    return intervals, conll_interval
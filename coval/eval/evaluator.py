@@ -1,9 +1,14 @@
 """Some parts are borrowed from
 https://github.com/clarkkev/deep-coref/blob/master/evaluation.py
 """
+from array import array
 from collections import Counter
+from itertools import chain
+import math
 import numpy as np
 from scipy.optimize import linear_sum_assignment
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
 
 
 def f1(p_num, p_den, r_num, r_den, beta=1):
@@ -14,106 +19,411 @@ def f1(p_num, p_den, r_num, r_den, beta=1):
 
 
 def evaluate_non_referrings(doc_non_referring_infos):
-    tp, _tn, fp, fn = 0, 0, 0, 0
-
-    for doc_id in doc_non_referring_infos:
-        key_non_referrings, sys_non_referrings = doc_non_referring_infos[
-                doc_id]
-        for m in key_non_referrings:
-            if m in sys_non_referrings:
-                tp += 1
-            else:
-                fn += 1
-        for m in sys_non_referrings:
-            if m not in key_non_referrings:
-                fp += 1
+    """Same as coval.arrau.non_referring.evaluate_non_referrings, which is
+    only imported when it is used."""
+    from coval.arrau import non_referring
+    return non_referring.evaluate_non_referrings(doc_non_referring_infos)
+
+
+def get_document_counts(coref_info, metric, contingency=None):
+    """Returns the (p_num, p_den, r_num, r_den) counts of `metric` for the
+    coref info of a single document.  The counts of MUC, B-cubed, CEAF and
+    LEA are computed from the Contingency of the document, which can be
+    shared by several metrics."""
+    if metric in CONTINGENCY_METRICS:
+        if contingency is None:
+            contingency = Contingency(coref_info)
+        return CONTINGENCY_METRICS[metric](contingency)
+
+    (key_clusters, sys_clusters, key_mention_sys_cluster,
+            sys_mention_key_cluster) = coref_info
+
+    if metric == ceafe or metric == ceafm:
+        pn, pd, rn, rd = metric(sys_clusters, key_clusters)
+    elif metric == lea or metric == pairwise_lea:
+        pn, pd = metric(sys_clusters, key_clusters,
+                sys_mention_key_cluster)
+        rn, rd = metric(key_clusters, sys_clusters,
+                key_mention_sys_cluster)
+    else:
+        pn, pd = metric(sys_clusters, sys_mention_key_cluster)
+        rn, rd = metric(key_clusters, key_mention_sys_cluster)
+    return pn, pd, rn, rd
+
+
+class Contingency:
+    """Sparse key x system contingency counts of a single document.
+
+    recall_counts holds the number of mentions of each key cluster that
+    key_mention_sys_cluster assigns to each system cluster, as arrays
+    (rows, cols, counts) sorted by rows, and precision_counts the same for
+    the system clusters and sys_mention_key_cluster.  key_only and sys_only
+    are the numbers of mentions of each cluster that are not assigned,
+    which are only computed on demand.
+    """
+
+    def __init__(self, coref_info):
+        (self.key_clusters, self.sys_clusters, key_mention_sys_cluster,
+                sys_mention_key_cluster) = coref_info
+        self.key_sizes = np.array([len(c) for c in self.key_clusters],
+                dtype=np.int64)
+        self.sys_sizes = np.array([len(c) for c in self.sys_clusters],
+                dtype=np.int64)
+
+        self.recall_counts = get_assignment_counts(self.key_clusters,
+                key_mention_sys_cluster)
+        self.precision_counts = get_assignment_counts(self.sys_clusters,
+                sys_mention_key_cluster)
+
+        self.ceaf_overlaps = None
+
+    @property
+    def key_only(self):
+        return self.key_sizes - get_row_sums(self.recall_counts,
+                len(self.key_sizes))
+
+    @property
+    def sys_only(self):
+        return self.sys_sizes - get_row_sums(self.precision_counts,
+                len(self.sys_sizes))
+
+    def get_ceaf_overlaps(self):
+        """Returns the get_cluster_overlaps of the key and system clusters,
+        or None if CEAF has to compare the mentions of all cluster pairs."""
+        if self.ceaf_overlaps is None:
+            self.ceaf_overlaps = get_cluster_overlaps(self.key_clusters,
+                    self.sys_clusters) or ()
+        return self.ceaf_overlaps or None
+
+
+def get_assignment_counts(clusters, mention_to_cluster):
+    pair_counts = Counter()
+    for i, c in enumerate(clusters):
+        for m in c:
+            j = mention_to_cluster.get(m)
+            if j is not None:
+                pair_counts[i, j] += 1
+    pairs = np.array(list(pair_counts), dtype=np.int64).reshape(-1, 2)
+    return pairs[:, 0], pairs[:, 1], np.array(list(pair_counts.values()),
+            dtype=np.int64)
+
+
+def get_row_sums(table, n_rows):
+    rows, _, counts = table
+    return np.bincount(rows, weights=counts, minlength=n_rows).astype(
+            np.int64)
 
-    recall = tp / float(tp + fn) if (tp + fn) > 0 else 0
-    precision = tp / float(tp + fp) if (tp + fp) > 0 else 0
-    f1 = (2 * recall * precision / (recall + precision)
-            if (recall + precision) > 0 else 0)
 
-    return recall, precision, f1
+def sequential_sum(values):
+    """Sums `values` from left to right, as the loops over the clusters
+    did, rather than with the pairwise summation of np.sum."""
+    return float(np.cumsum(values)[-1]) if len(values) else 0
 
 
 class Evaluator:
+    """Sums the per-document counts of a metric.  These are (p_num, p_den,
+    r_num, r_den) for most metrics, and the same counts for the
+    coreference and then the non-coreference links for BLANC.
+
+    Documents that are added with a doc id keep their counts in doc_counts,
+    so they can later be removed or replaced by subtracting them from the
+    sums."""
+
     def __init__(self, metric, beta=1, keep_aggregated_values=False):
-        self.p_num = 0
-        self.p_den = 0
-        self.r_num = 0
-        self.r_den = 0
+        self.counts = [0] * COUNTS_NUM.get(metric, 4)
         self.metric = metric
         self.beta = beta
         self.keep_aggregated_values = keep_aggregated_values
+        self.doc_counts = {}
+        self.anonymous_docs_num = 0
 
+        # The per-document counts are kept as compact arrays of integers,
+        # which become arrays of doubles at the first float count
         if keep_aggregated_values:
-            self.aggregated_p_num = []
-            self.aggregated_p_den = []
-            self.aggregated_r_num = []
-            self.aggregated_r_den = []
+            self.aggregated_counts = [array('q') for _ in self.counts]
 
-    def update(self, coref_info):
-        (key_clusters, sys_clusters, key_mention_sys_cluster,
-                sys_mention_key_cluster) = coref_info
+    @property
+    def p_num(self):
+        return self.counts[0]
 
-        if self.metric == ceafe or self.metric == ceafm:
-            pn, pd, rn, rd = self.metric(sys_clusters, key_clusters)
-        elif self.metric == lea:
-            pn, pd = self.metric(sys_clusters, key_clusters,
-                    sys_mention_key_cluster)
-            rn, rd = self.metric(key_clusters, sys_clusters,
-                    key_mention_sys_cluster)
-        else:
-            pn, pd = self.metric(sys_clusters, sys_mention_key_cluster)
-            rn, rd = self.metric(key_clusters, key_mention_sys_cluster)
-        self.p_num += pn
-        self.p_den += pd
-        self.r_num += rn
-        self.r_den += rd
+    @property
+    def p_den(self):
+        return self.counts[1]
+
+    @property
+    def r_num(self):
+        return self.counts[2]
+
+    @property
+    def r_den(self):
+        return self.counts[3]
+
+    def update(self, coref_info, contingency=None):
+        self.add_counts(*get_document_counts(coref_info, self.metric,
+                contingency))
+
+    def add_counts(self, *counts):
+        for i, count in enumerate(counts):
+            self.counts[i] += count
+        self.anonymous_docs_num += 1
 
         if self.keep_aggregated_values:
-            self.aggregated_p_num.append(pn)
-            self.aggregated_p_den.append(pd)
-            self.aggregated_r_num.append(rn)
-            self.aggregated_r_den.append(rd)
+            for i, count in enumerate(counts):
+                values = self.aggregated_counts[i]
+                if values.typecode == 'q' and not isinstance(count,
+                        (int, np.integer)):
+                    values = self.aggregated_counts[i] = array('d', values)
+                values.append(count)
+
+    def add(self, doc_id, coref_info, contingency=None):
+        """Adds the counts of the document `doc_id`."""
+        self.add_doc_counts(doc_id, get_document_counts(coref_info,
+                self.metric, contingency))
+
+    def add_doc_counts(self, doc_id, counts):
+        if doc_id in self.doc_counts:
+            raise KeyError('Document %s is already evaluated' % doc_id)
+        counts = tuple(counts)
+        for i, count in enumerate(counts):
+            self.counts[i] += count
+        self.doc_counts[doc_id] = counts
+
+    def remove(self, doc_id):
+        """Subtracts the counts of the document `doc_id`."""
+        counts = self.doc_counts.pop(doc_id)
+        if not self.doc_counts and not self.anonymous_docs_num:
+            # Avoids the rounding errors of subtracting the float counts
+            self.counts = [0] * len(self.counts)
+            return
+        for i, count in enumerate(counts):
+            self.counts[i] -= count
+
+    def replace(self, doc_id, coref_info, contingency=None):
+        """Replaces the counts of the document `doc_id` with those of
+        `coref_info`.  The new counts are computed first, so the Evaluator
+        is unchanged if that fails."""
+        self.replace_doc_counts(doc_id, get_document_counts(coref_info,
+                self.metric, contingency))
+
+    def replace_doc_counts(self, doc_id, counts):
+        if doc_id not in self.doc_counts:
+            raise KeyError('Document %s is not evaluated' % doc_id)
+        self.remove(doc_id)
+        self.add_doc_counts(doc_id, counts)
 
     def get_f1(self):
-        return f1(self.p_num,
-                self.p_den,
-                self.r_num,
-                self.r_den,
-                beta=self.beta)
+        return get_scores(self.metric, self.counts, self.beta)[2]
 
     def get_recall(self):
-        return 0 if self.r_num == 0 else self.r_num / float(self.r_den)
+        return get_scores(self.metric, self.counts, self.beta)[0]
 
     def get_precision(self):
-        return 0 if self.p_num == 0 else self.p_num / float(self.p_den)
+        return get_scores(self.metric, self.counts, self.beta)[1]
 
     def get_prf(self):
         return self.get_precision(), self.get_recall(), self.get_f1()
 
     def get_counts(self):
-        return self.p_num, self.p_den, self.r_num, self.r_den
+        return tuple(self.counts)
+
+    def merge(self, other):
+        """Adds the documents of the Evaluator `other` of the same metric.
+        The per-document counts of `other` are added one by one when it
+        keeps them, so merging the Evaluators of consecutive shards of
+        documents in order gives the same sums as a single Evaluator."""
+        if other.metric != self.metric or other.beta != self.beta:
+            raise ValueError('Cannot merge the evaluators of %s and %s'
+                    % (self.metric.__name__, other.metric.__name__))
+        duplicate_docs = set(self.doc_counts) & set(other.doc_counts)
+        if duplicate_docs:
+            raise KeyError('Documents %s are already evaluated'
+                    % sorted(duplicate_docs))
+
+        if other.keep_aggregated_values:
+            for counts in zip(*other.aggregated_counts):
+                self.add_counts(*counts)
+            for doc_id, counts in other.doc_counts.items():
+                for i, count in enumerate(counts):
+                    self.counts[i] += count
+        else:
+            if self.keep_aggregated_values and other.anonymous_docs_num:
+                raise ValueError('Cannot merge the per-document values of '
+                        'an evaluator that does not keep them')
+            for i, count in enumerate(other.counts):
+                self.counts[i] += count
+            self.anonymous_docs_num += other.anonymous_docs_num
+        self.doc_counts.update(other.doc_counts)
+
+    def to_dict(self):
+        """Returns the state of the Evaluator as a JSON serializable dict,
+        which from_dict turns back into an Evaluator."""
+        state = {'metric': self.metric.__name__, 'beta': self.beta,
+                'counts': get_json_values(self.counts),
+                'anonymous_docs_num': self.anonymous_docs_num,
+                'doc_counts': [[doc_id, get_json_values(counts)]
+                for doc_id, counts in self.doc_counts.items()]}
+        if self.keep_aggregated_values:
+            state['aggregated_counts'] = [get_json_values(values)
+                    for values in self.aggregated_counts]
+        return state
 
     def get_aggregated_values(self):
-        return (self.aggregated_p_num, self.aggregated_p_den,
-                self.aggregated_r_num, self.aggregated_r_den)
+        """Returns the list of the per-document values of each count, for
+        the documents of add_counts and then those of doc_counts."""
+        return tuple(values.tolist() + [counts[i] for counts in
+                self.doc_counts.values()]
+                for i, values in enumerate(self.aggregated_counts))
+
+    def get_aggregated_arrays(self):
+        """Same as get_aggregated_values, as NumPy arrays."""
+        return tuple(np.concatenate([np.array(values, dtype=float),
+                np.array([counts[i] for counts in self.doc_counts.values()],
+                dtype=float)])
+                for i, values in enumerate(self.aggregated_counts))
+
+
+class MultiEvaluator:
+    """The Evaluators of several metrics, updated in a single pass over the
+    documents.  The Contingency of each document, with its cluster sizes
+    and overlap tables, is built once and shared by all the metrics.
+    `evaluators` are existing Evaluators of the metrics, if given."""
+
+    def __init__(self, metrics, beta=1, keep_aggregated_values=False,
+            evaluators=None):
+        self.metrics = list(metrics)
+        self.evaluators = list(evaluators) if evaluators is not None else [
+                Evaluator(metric, beta=beta,
+                keep_aggregated_values=keep_aggregated_values)
+                for metric in self.metrics]
+
+    def update(self, coref_info):
+        for e, counts in zip(self.evaluators, get_metrics_counts(coref_info,
+                self.metrics)):
+            e.add_counts(*counts)
+
+    def add(self, doc_id, coref_info):
+        metrics_counts = get_metrics_counts(coref_info, self.metrics)
+        if any(doc_id in e.doc_counts for e in self.evaluators):
+            raise KeyError('Document %s is already evaluated' % doc_id)
+        for e, counts in zip(self.evaluators, metrics_counts):
+            e.add_doc_counts(doc_id, counts)
+
+    def remove(self, doc_id):
+        if not all(doc_id in e.doc_counts for e in self.evaluators):
+            raise KeyError('Document %s is not evaluated' % doc_id)
+        for e in self.evaluators:
+            e.remove(doc_id)
+
+    def replace(self, doc_id, coref_info):
+        """Replaces the counts of the document `doc_id` in all the
+        Evaluators, or in none of them if computing the new counts
+        fails."""
+        metrics_counts = get_metrics_counts(coref_info, self.metrics)
+        if not all(doc_id in e.doc_counts for e in self.evaluators):
+            raise KeyError('Document %s is not evaluated' % doc_id)
+        for e, counts in zip(self.evaluators, metrics_counts):
+            e.replace_doc_counts(doc_id, counts)
+
+    def get_scores(self):
+        """Returns the (recall, precision, F1) of each metric."""
+        return [get_scores(e.metric, e.counts, e.beta)
+                for e in self.evaluators]
+
+    def get_conll_score(self):
+        """Returns the average F1 of MUC, B-cubed and CEAFe, or None if one
+        of them is not evaluated."""
+        f1s = {e.metric: e.get_f1() for e in self.evaluators}
+        if not all(metric in f1s for metric in [muc, b_cubed, ceafe]):
+            return None
+        return (f1s[muc] + f1s[b_cubed] + f1s[ceafe]) / 3
+
+
+def get_metrics_counts(coref_info, metrics):
+    """Returns the get_document_counts of each of `metrics` for the coref
+    info of a single document, with one shared Contingency."""
+    contingency = Contingency(coref_info) if any(
+            metric in CONTINGENCY_METRICS for metric in metrics) else None
+    return [get_document_counts(coref_info, metric, contingency)
+            for metric in metrics]
+
+
+def from_dict(state):
+    """Returns the Evaluator of a state of Evaluator.to_dict."""
+    e = Evaluator(METRICS[state['metric']], beta=state['beta'],
+            keep_aggregated_values='aggregated_counts' in state)
+    e.counts = list(state['counts'])
+    e.anonymous_docs_num = state['anonymous_docs_num']
+    e.doc_counts = {doc_id: tuple(counts)
+            for doc_id, counts in state['doc_counts']}
+    if e.keep_aggregated_values:
+        e.aggregated_counts = [array('q' if all(isinstance(value, int)
+                for value in values) else 'd', values)
+                for values in state['aggregated_counts']]
+    return e
+
+
+def get_json_values(values):
+    return [value.item() if isinstance(value, np.generic) else value
+            for value in values]
+
+
+def get_scores(metric, counts, beta=1):
+    """Returns the (recall, precision, F) of the summed `counts` of
+    `metric`."""
+    if metric == blanc:
+        return get_blanc_scores(counts, beta)
+    return get_count_scores(*counts, beta=beta)
+
+
+def get_count_scores(p_num, p_den, r_num, r_den, beta=1):
+    return (0 if r_num == 0 else r_num / float(r_den),
+            0 if p_num == 0 else p_num / float(p_den),
+            f1(p_num, p_den, r_num, r_den, beta=beta))
+
+
+def get_blanc_scores(counts, beta=1):
+    """BLANC averages the scores of the coreference and the non-coreference
+    links, unless the key has only one kind of links."""
+    coref_scores = get_count_scores(*counts[:4], beta=beta)
+    non_coref_scores = get_count_scores(*counts[4:], beta=beta)
+    key_coref_links, key_non_coref_links = counts[3], counts[7]
+
+    if key_coref_links == 0:
+        return non_coref_scores
+    if key_non_coref_links == 0:
+        return coref_scores
+    return tuple((c + n) / 2.0 for c, n in zip(coref_scores,
+            non_coref_scores))
 
 
 def evaluate_documents(doc_coref_infos, metric, beta=1):
-    evaluator = Evaluator(metric, beta=beta)
-    for doc_id in doc_coref_infos:
-        evaluator.update(doc_coref_infos[doc_id])
-    return (evaluator.get_recall(), evaluator.get_precision(),
-            evaluator.get_f1())
+    return evaluate_metrics(doc_coref_infos, [metric], beta).get_scores()[0]
 
 
 def get_document_evaluations(doc_coref_infos, metric, beta=1):
-    evaluator = Evaluator(metric, beta=beta, keep_aggregated_values=True)
-    for doc_id in doc_coref_infos:
-        evaluator.update(doc_coref_infos[doc_id])
-    return evaluator.get_aggregated_values()
+    return evaluate_metrics(doc_coref_infos, [metric], beta,
+            keep_aggregated_values=True).evaluators[0].get_aggregated_values()
+
+
+def evaluate_metrics(doc_coref_infos, metrics, beta=1,
+        keep_aggregated_values=False):
+    """Returns the MultiEvaluator of `metrics` for all the documents of
+    `doc_coref_infos`, which are visited once."""
+    return evaluate_doc_stream(((doc_id, doc_coref_infos[doc_id])
+            for doc_id in doc_coref_infos), metrics, beta,
+            keep_aggregated_values)
+
+
+def evaluate_doc_stream(doc_coref_infos, metrics, beta=1,
+        keep_aggregated_values=False):
+    """Same as evaluate_metrics for an iterable of (doc, coref_info), e.g.
+    reader.iter_coref_infos.  Each coref info is counted for all the
+    metrics as soon as it is built and is not referenced afterwards, so the
+    memory does not grow with the number of documents."""
+    multi_evaluator = MultiEvaluator(metrics, beta, keep_aggregated_values)
+    for _, coref_info in doc_coref_infos:
+        multi_evaluator.update(coref_info)
+    return multi_evaluator
 
 
 def mentions(clusters, mention_to_gold):
@@ -162,27 +472,148 @@ def phi3(c1, c2):
     return len([m for m in c1 if m in c2])
 
 def ceafe(clusters, gold_clusters):
-    clusters = [c for c in clusters]
-    scores = np.zeros((len(gold_clusters), len(clusters)))
-    for i in range(len(gold_clusters)):
-        for j in range(len(clusters)):
-            scores[i, j] = phi4(gold_clusters[i], clusters[j])
-    row_ind, col_ind = linear_sum_assignment(-scores)
-    similarity = scores[row_ind, col_ind].sum()
-    return similarity, len(clusters), similarity, len(gold_clusters)
+    return ceaf(clusters, gold_clusters, phi4)
 
 def ceafm(clusters, gold_clusters):
+    return ceaf(clusters, gold_clusters, phi3)
+
+
+# Larger score matrices are aligned per connected component
+MAX_DENSE_CEAF_SIZE = 10000
+
+
+def ceaf(clusters, gold_clusters, phi):
+    """CEAF with the similarity `phi` (phi4 for CEAF-e, phi3 for CEAF-m).
+
+    The similarities are only computed for the cluster pairs that share
+    mentions.  For large documents, the optimal alignment is found
+    separately for each connected component of these pairs, without the
+    full score matrix.  The similarity is that of dense_ceaf, up to the
+    rounding of equally good alignments.
+    """
+    overlaps = get_cluster_overlaps(gold_clusters, clusters)
+    if overlaps is None:
+        return dense_ceaf(clusters, gold_clusters, phi)
+    return ceaf_from_overlaps(overlaps,
+            np.array([len(c) for c in gold_clusters], dtype=np.int64),
+            np.array([len(c) for c in clusters], dtype=np.int64), phi)
+
+
+def ceaf_from_overlaps(overlaps, gold_sizes, sizes, phi):
+    rows, cols, counts = overlaps
+    if phi == phi4:
+        scores = 2 * counts / (gold_sizes[rows] + sizes[cols]).astype(float)
+    else:
+        scores = counts.astype(float)
+
+    if len(gold_sizes) * len(sizes) <= MAX_DENSE_CEAF_SIZE:
+        dense_scores = np.zeros((len(gold_sizes), len(sizes)))
+        dense_scores[rows, cols] = scores
+        row_ind, col_ind = linear_sum_assignment(-dense_scores)
+        alignments = dense_scores[row_ind, col_ind]
+    else:
+        alignments = get_component_alignments(rows, cols, scores,
+                len(gold_sizes), len(sizes))
+
+    # The aligned scores are summed exactly, so that the similarity does
+    # not depend on the order of the alignments
+    similarity = math.fsum(alignments)
+    return similarity, len(sizes), similarity, len(gold_sizes)
+
+
+def get_component_alignments(rows, cols, scores, n_rows, n_cols):
+    """Returns the scores of an optimal alignment of the overlapping
+    (row, col) pairs.  Clusters without overlaps add nothing to the
+    alignment, so each connected component of the pairs is aligned
+    separately, and a component of a single pair is aligned as is."""
+    if not len(rows):
+        return scores
+    _, labels = connected_components(coo_matrix(
+            (np.ones(len(rows)), (rows, cols + n_rows)),
+            shape=(n_rows + n_cols,) * 2), directed=False)
+    edge_components = labels[rows]
+    is_single = np.bincount(edge_components)[edge_components] == 1
+    alignments = [scores[is_single]]
+
+    # Edges of the same component are contiguous after a stable sort
+    order = np.flatnonzero(~is_single)
+    order = order[np.argsort(edge_components[order], kind='stable')]
+    bounds = np.flatnonzero(np.diff(edge_components[order])) + 1
+    for edges in np.split(order, bounds) if len(order) else []:
+        component_rows, row_ind = np.unique(rows[edges], return_inverse=True)
+        component_cols, col_ind = np.unique(cols[edges], return_inverse=True)
+        component_scores = np.zeros((len(component_rows),
+                len(component_cols)))
+        component_scores[row_ind, col_ind] = scores[edges]
+        r, c = linear_sum_assignment(-component_scores)
+        alignments.append(component_scores[r, c])
+
+    return np.concatenate(alignments)
+
+
+def get_cluster_overlaps(gold_clusters, clusters):
+    """Returns the arrays (rows, cols, counts) of the number of mentions of
+    each gold cluster that are in each cluster, for the pairs that overlap.
+    Mentions are matched by a hash index, so None is returned if mention
+    equality is not consistent with the mention hashes."""
+    if not has_hash_equality(gold_clusters, clusters):
+        return None
+
+    index = {}
+    for j, c in enumerate(clusters):
+        for m in c:
+            cluster_ids = index.setdefault(m, [])
+            if not cluster_ids or cluster_ids[-1] != j:
+                cluster_ids.append(j)
+
+    pair_counts = Counter((i, j) for i, c in enumerate(gold_clusters)
+            for m in c for j in index.get(m, ()))
+    pairs = np.array(list(pair_counts), dtype=np.int64).reshape(-1, 2)
+    return pairs[:, 0], pairs[:, 1], np.array(list(pair_counts.values()),
+            dtype=np.int64)
+
+
+def has_hash_equality(*cluster_lists):
+    """Whether equal mentions of `cluster_lists` have equal hashes.  This is not
+    the case for ARRAU markables with a MIN span, which are equal to the
+    markables within their boundaries, nor for CoNLL mentions if only some
+    of them have minimum spans."""
+    with_min_spans = without_min_spans = False
+    for c in chain.from_iterable(cluster_lists):
+        for m in c:
+            if getattr(m, 'MIN', None):
+                return False
+            if getattr(m, 'min_spans', None):
+                with_min_spans = True
+            else:
+                without_min_spans = True
+    return not (with_min_spans and without_min_spans)
+
+
+def dense_ceaf(clusters, gold_clusters, phi):
+    """Reference CEAF that scores every pair of clusters."""
     clusters = [c for c in clusters]
     scores = np.zeros((len(gold_clusters), len(clusters)))
     for i in range(len(gold_clusters)):
         for j in range(len(clusters)):
-            scores[i, j] = phi3(gold_clusters[i], clusters[j])
+            scores[i, j] = phi(gold_clusters[i], clusters[j])
     row_ind, col_ind = linear_sum_assignment(-scores)
-    similarity = scores[row_ind, col_ind].sum()
+    similarity = math.fsum(scores[row_ind, col_ind])
     return similarity, len(clusters), similarity, len(gold_clusters)
 
 
 def lea(input_clusters, output_clusters, mention_to_gold):
+    """LEA of `input_clusters` from their assignment counts to
+    `output_clusters`, as lea_from_counts.  The result is that of
+    pairwise_lea."""
+    return lea_from_counts(np.array([len(c) for c in input_clusters],
+            dtype=np.int64), get_assignment_counts(input_clusters,
+            mention_to_gold), np.array([len(c) for c in output_clusters],
+            dtype=np.int64))
+
+
+def pairwise_lea(input_clusters, output_clusters, mention_to_gold):
+    """Reference LEA that enumerates the mention pairs of each cluster."""
     num, den = 0, 0
 
     for c in input_clusters:
@@ -215,3 +646,136 @@ def lea(input_clusters, output_clusters, mention_to_gold):
         den += len(c)
 
     return num, den
+
+
+def get_muc_counts(contingency):
+    pn, pd = muc_from_counts(contingency.sys_sizes,
+            contingency.precision_counts)
+    rn, rd = muc_from_counts(contingency.key_sizes, contingency.recall_counts)
+    return pn, pd, rn, rd
+
+
+def muc_from_counts(sizes, table):
+    _, _, counts = table
+    # Each linked cluster takes one of the assigned mentions of a cluster
+    return (int(counts.sum()) - len(counts),
+            int(sizes.sum()) - len(sizes))
+
+
+def get_b_cubed_counts(contingency):
+    pn, pd = b_cubed_from_counts(contingency.sys_sizes,
+            contingency.precision_counts)
+    rn, rd = b_cubed_from_counts(contingency.key_sizes,
+            contingency.recall_counts)
+    return pn, pd, rn, rd
+
+
+def b_cubed_from_counts(sizes, table):
+    rows, _, counts = table
+    correct = np.bincount(rows, weights=counts * counts,
+            minlength=len(sizes))
+    return sequential_sum(correct / sizes), int(sizes.sum())
+
+
+def get_lea_counts(contingency):
+    pn, pd = lea_from_counts(contingency.sys_sizes,
+            contingency.precision_counts, contingency.key_sizes)
+    rn, rd = lea_from_counts(contingency.key_sizes,
+            contingency.recall_counts, contingency.sys_sizes)
+    return pn, pd, rn, rd
+
+
+def lea_from_counts(sizes, table, output_sizes):
+    """LEA of the clusters of `sizes` from their assignment counts to the
+    output clusters of `output_sizes`.  The common links of a cluster are
+    the pairs of its mentions that are assigned to the same output cluster,
+    and a singleton has a common link if it is assigned to an output
+    singleton."""
+    rows, cols, counts = table
+    common_links = np.bincount(rows, weights=counts * (counts - 1) // 2,
+            minlength=len(sizes))
+    is_singleton = sizes == 1
+    common_links[rows[is_singleton[rows]
+            & (output_sizes[cols] == 1)]] = 1
+
+    all_links = np.where(is_singleton, 1, sizes * (sizes - 1) / 2.0)
+    return (sequential_sum(sizes * common_links / all_links),
+            int(sizes.sum()))
+
+
+def get_ceafe_counts(contingency):
+    return ceaf_from_contingency(contingency, phi4)
+
+
+def get_ceafm_counts(contingency):
+    return ceaf_from_contingency(contingency, phi3)
+
+
+def ceaf_from_contingency(contingency, phi):
+    overlaps = contingency.get_ceaf_overlaps()
+    if overlaps is None:
+        return dense_ceaf(contingency.sys_clusters, contingency.key_clusters,
+                phi)
+    return ceaf_from_overlaps(overlaps, contingency.key_sizes,
+            contingency.sys_sizes, phi)
+
+
+def blanc(clusters, gold_clusters, mention_to_gold):
+    """Returns the BLANC counts (p_num, p_den, r_num, r_den) of the
+    coreference links followed by those of the non-coreference links.
+    `mention_to_gold` assigns the mentions of `clusters` to `gold_clusters`.
+
+    Only the mentions that are in both the key and the response can make
+    common links, which extends BLANC to system mentions as in Luo et al.
+    (2014).  With gold mentions this is the original BLANC.
+    """
+    return blanc_from_counts(
+            np.array([len(c) for c in clusters], dtype=np.int64),
+            np.array([len(c) for c in gold_clusters], dtype=np.int64),
+            get_assignment_counts(clusters, mention_to_gold))
+
+
+def get_blanc_counts(contingency):
+    return blanc_from_counts(contingency.sys_sizes, contingency.key_sizes,
+            contingency.precision_counts)
+
+
+def blanc_from_counts(sizes, gold_sizes, table):
+    """BLANC counts from the cluster sizes and the overlap counts, without
+    enumerating the mention pairs.  The non-coreference links that are
+    common to both sides are the pairs of shared mentions minus the pairs
+    that are coreferent on either side."""
+    rows, cols, counts = table
+    coref_links = get_links_num(sizes)
+    gold_coref_links = get_links_num(gold_sizes)
+    non_coref_links = get_links_num(sizes.sum()) - coref_links
+    gold_non_coref_links = get_links_num(gold_sizes.sum()) - gold_coref_links
+
+    common_coref_links = get_links_num(counts)
+    common_non_coref_links = (get_links_num(counts.sum())
+            - get_links_num(np.bincount(rows, weights=counts).astype(np.int64))
+            - get_links_num(np.bincount(cols, weights=counts).astype(np.int64))
+            + common_coref_links)
+
+    return (common_coref_links, coref_links, common_coref_links,
+            gold_coref_links, common_non_coref_links, non_coref_links,
+            common_non_coref_links, gold_non_coref_links)
+
+
+def get_links_num(sizes):
+    """Returns the number of mention pairs of clusters of `sizes`."""
+    return int(np.sum(sizes * (sizes - 1) // 2))
+
+
+# The metrics whose counts are reductions of the Contingency of a document
+CONTINGENCY_METRICS = {muc: get_muc_counts, b_cubed: get_b_cubed_counts,
+        ceafe: get_ceafe_counts, ceafm: get_ceafm_counts,
+        lea: get_lea_counts, blanc: get_blanc_counts}
+
+# The number of counts of the metrics that do not have four
+COUNTS_NUM = {blanc: 8}
+
+# The metrics of serialized Evaluators, by name.  The non_referrings metric
+# is added by coval.arrau.non_referring.
+METRICS = {metric.__name__: metric for metric in [mentions, muc, b_cubed,
+        ceafe, ceafm, lea, pairwise_lea, blanc]}
@@ -0,0 +1,115 @@
+"""Paired significance tests between two systems scored on the same key.
+
+Both tests work on the per-document counts of the Evaluators of the two
+systems, which must keep their aggregated values and be updated with the
+same documents in the same order.  The statistic is the difference of the
+F1 of each metric, and of the CoNLL score.
+
+Approximate randomization swaps the counts of the two systems on a random
+subset of the documents.  With the 0/1 swap matrix S of a chunk of rounds
+and the per-document count differences D = B - A, the summed counts of
+the rounds are A + S @ D and B - S @ D.  The paired bootstrap resamples the
+documents with replacement, and the same resamples are used for both
+systems.
+
+The rounds are split into blocks of a fixed size, each with its own seed
+spawned from `seed`, so the p-values do not depend on the number of
+processes that score the blocks.
+"""
+import os
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from coval.eval import bootstrap
+
+TESTS = ['randomization', 'bootstrap']
+
+# Tolerance of the comparisons with the observed differences, which are
+# computed from differently summed counts
+EPSILON = 1e-12
+
+
+def get_differences(layout, counts_a, counts_b):
+    """Returns the F1 differences of each metric of `layout`, followed by
+    the CoNLL difference if it is evaluated, as an (n_metrics[+1], n)
+    array for the summed counts of shape (n, n_counts)."""
+    scores_a = bootstrap.get_layout_scores(layout, counts_a)
+    scores_b = bootstrap.get_layout_scores(layout, counts_b)
+    differences = [f1_a - f1_b for (_, _, f1_a), (_, _, f1_b)
+            in zip(scores_a, scores_b)]
+
+    conll_a = bootstrap.get_layout_conll_scores(layout, scores_a)
+    if conll_a is not None:
+        differences.append(conll_a
+                - bootstrap.get_layout_conll_scores(layout, scores_b))
+    return np.array(differences)
+
+
+def count_block(test, layout, doc_counts_a, doc_counts_b, observed, size,
+        seed):
+    """Returns how many of `size` rounds of `test` have a difference at
+    least as extreme as `observed`, for each difference."""
+    rng = np.random.default_rng(seed)
+    n_docs = len(doc_counts_a)
+
+    if test == 'randomization':
+        swaps = rng.integers(0, 2, size=(size, n_docs)).astype(float)
+        swapped = swaps @ (doc_counts_b - doc_counts_a)
+        differences = get_differences(layout,
+                doc_counts_a.sum(axis=0) + swapped,
+                doc_counts_b.sum(axis=0) - swapped)
+        extreme = np.abs(differences) >= np.abs(observed)[:, None] - EPSILON
+    else:
+        indices = rng.integers(0, n_docs, size=(size, n_docs))
+        weights = np.bincount((indices + n_docs * np.arange(size)[:, None]
+                ).ravel(), minlength=size * n_docs).reshape(size, n_docs)
+        differences = get_differences(layout, weights @ doc_counts_a,
+                weights @ doc_counts_b)
+        # The resampled differences are centered on the observed ones
+        extreme = (np.abs(differences - observed[:, None])
+                >= np.abs(observed)[:, None] - EPSILON)
+
+    return extreme.sum(axis=1)
+
+
+def paired_test(evaluators_a, evaluators_b, test='randomization',
+        n_rounds=10000, seed=None, jobs=1):
+    """Returns the p-values of the F1 differences between the Evaluators
+    of system A and B, metric by metric, and the p-value of the CoNLL
+    score or None if it is not evaluated.  With jobs > 1 the blocks of
+    rounds are scored in parallel processes."""
+    if test not in TESTS:
+        raise ValueError('Unknown significance test: %s' % test)
+    layout = bootstrap.get_counts_layout(evaluators_a)
+    if layout != bootstrap.get_counts_layout(evaluators_b):
+        raise ValueError('The two systems are not scored with the same '
+                'metrics')
+
+    doc_counts_a = bootstrap.get_document_counts(evaluators_a)
+    doc_counts_b = bootstrap.get_document_counts(evaluators_b)
+    if doc_counts_a.shape != doc_counts_b.shape:
+        raise ValueError('The two systems are not scored on the same '
+                'documents')
+
+    observed = get_differences(layout, doc_counts_a.sum(axis=0)[None],
+            doc_counts_b.sum(axis=0)[None])[:, 0]
+
+    block_size = max(1, bootstrap.MAX_CHUNK_CELLS // max(len(doc_counts_a),
+            1))
+    sizes = [min(block_size, n_rounds - start)
+            for start in range(0, n_rounds, block_size)]
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+    blocks = [(test, layout, doc_counts_a, doc_counts_b, observed, size,
+            block_seed) for size, block_seed in zip(sizes, seeds)]
+
+    if jobs == 1 or len(blocks) < 2:
+        counts = [count_block(*block) for block in blocks]
+    else:
+        with ProcessPoolExecutor(max_workers=min(jobs or os.cpu_count(),
+                len(blocks))) as executor:
+            counts = list(executor.map(count_block, *zip(*blocks)))
+
+    extreme_num = sum(counts, np.zeros(len(observed), dtype=int))
+    p_values = [float(p) for p in (extreme_num + 1) / (n_rounds + 1)]
+    if len(p_values) > len(layout):
+        return p_values[:-1], p_values[-1]
+    return p_values, None
@@ -1,13 +1,66 @@
+import glob
+import json
+import os
 import sys
+from coval.conll import batch
+from coval.conll import cache
+from coval.conll import parallel
 from coval.conll import reader
+from coval.conll import store
 from coval.conll import util
+from coval.eval import bootstrap
 from coval.eval import evaluator
+from coval.eval import significance
 
 
 def main():
     allmetrics = [('mentions', evaluator.mentions), ('muc', evaluator.muc),
             ('bcub', evaluator.b_cubed), ('ceafe', evaluator.ceafe),
-            ('lea', evaluator.lea)]
+            ('lea', evaluator.lea), ('blanc', evaluator.blanc)]
+
+    if 'all' in sys.argv:
+        metrics = allmetrics
+    else:
+        metrics = [(name, metric) for name, metric in allmetrics
+                if name in sys.argv]
+        if not metrics:
+            metrics = allmetrics
+
+    n_resamples = 0
+    if '--bootstrap' in sys.argv:
+        n_resamples = int(sys.argv[sys.argv.index('--bootstrap') + 1])
+    seed = None
+    if '--seed' in sys.argv:
+        seed = int(sys.argv[sys.argv.index('--seed') + 1])
+
+    if '--reduce' in sys.argv:
+        reduce_states(get_state_files(), n_resamples, seed)
+        return
+
+    doc_store = None
+    if '--doc-store' in sys.argv:
+        if any(option in sys.argv for option in ['--jobs', '--key-cache',
+                '--batch', '--compare', '--shard']):
+            exit_with_message('--doc-store cannot be used with --jobs, '
+                    '--key-cache, --batch, --compare or --shard')
+        doc_store = store.DocumentStore(
+                sys.argv[sys.argv.index('--doc-store') + 1])
+
+    if '--subset' in sys.argv:
+        subset_args = sys.argv[sys.argv.index('--subset') + 1:][:2]
+        if len(subset_args) > 1 and (subset_args[1].startswith('--')
+                or subset_args[1] == 'all'
+                or subset_args[1] in dict(allmetrics)):
+            subset_args = subset_args[:1]
+        if doc_store is None or not subset_args or (
+                subset_args[0].startswith('--')):
+            exit_with_message('Usage: python scorer.py --doc-store FILE '
+                    '--subset SYSTEM [DOC_IDS_FILE]')
+        if len(subset_args) > 1 and not os.path.isfile(subset_args[1]):
+            exit_with_message('The document ids file %s does not exist'
+                    % subset_args[1])
+        evaluate_subset(doc_store, subset_args, metrics)
+        return
 
     key_file = sys.argv[1]
     sys_file = sys.argv[2]
@@ -23,45 +76,254 @@ def main():
         min_span = True
         has_gold_parse = util.check_gold_parse_annotation(key_file)
         if not has_gold_parse:
-                util.parse_key_file(key_file)
-                key_file = key_file + ".parsed"
+                parse_cache = None
+                if '--parse-cache' in sys.argv:
+                    parse_cache = sys.argv[sys.argv.index('--parse-cache') + 1]
+                key_file = util.parse_key_file(key_file,
+                        cache_dir=parse_cache)
 
 
-    if 'all' in sys.argv:
-        metrics = allmetrics
-    else:
-        metrics = [(name, metric) for name, metric in allmetrics
-                if name in sys.argv]
-        if not metrics:
-            metrics = allmetrics
+    jobs = 1
+    if '--jobs' in sys.argv:
+        jobs = int(sys.argv[sys.argv.index('--jobs') + 1])
+
+    key_cache = None
+    if '--key-cache' in sys.argv:
+        key_cache = cache.KeyCache(sys.argv[sys.argv.index('--key-cache') + 1])
+
+    if '--batch' in sys.argv:
+        evaluate_batch(key_file, get_batch_sys_files(), metrics, NP_only,
+                remove_nested, keep_singletons, min_span, jobs, key_cache)
+        return
+
+    if '--compare' in sys.argv:
+        test = 'randomization'
+        if '--test' in sys.argv:
+            test = sys.argv[sys.argv.index('--test') + 1]
+        n_rounds = 10000
+        if '--rounds' in sys.argv:
+            n_rounds = int(sys.argv[sys.argv.index('--rounds') + 1])
+        compare(key_file, sys_file,
+                sys.argv[sys.argv.index('--compare') + 1], metrics, NP_only,
+                remove_nested, keep_singletons, min_span, test, n_rounds,
+                seed, jobs, key_cache)
+        return
+
+    if '--shard' in sys.argv:
+        if '--state' not in sys.argv[:-1]:
+            exit_with_message('Usage: python scorer.py key system --shard I/N '
+                    '--state FILE')
+        index, shards_num = sys.argv[sys.argv.index('--shard') + 1].split('/')
+        evaluate_shard(key_file, sys_file, metrics, NP_only, remove_nested,
+                keep_singletons, min_span, (int(index), int(shards_num)),
+                sys.argv[sys.argv.index('--state') + 1], key_cache)
+        return
 
     evaluate(key_file, sys_file, metrics, NP_only, remove_nested,
-            keep_singletons, min_span)
+            keep_singletons, min_span, jobs, key_cache, n_resamples, seed,
+            doc_store)
+
+
+def exit_with_message(message):
+    print(message)
+    sys.exit(1)
+
+
+def get_batch_sys_files():
+    """System files of the batch mode are the files that match the file
+    pattern after each --batch option."""
+    sys_files = []
+    for i, arg in enumerate(sys.argv[:-1]):
+        if arg == '--batch':
+            sys_files.extend(f for f in sorted(glob.glob(sys.argv[i + 1]))
+                    if os.path.isfile(f) and f != sys.argv[1])
+    return sys_files
+
+
+def get_state_files():
+    """State files of the reduce mode are all the arguments after
+    --reduce that are not options."""
+    option_values = set(sys.argv.index(option) + 1
+            for option in ['--bootstrap', '--seed'] if option in sys.argv)
+    return [arg for i, arg in enumerate(sys.argv[1:], 1)
+            if i > sys.argv.index('--reduce') and i not in option_values
+            and not arg.startswith('--')]
+
+
+def evaluate_shard(key_file, sys_file, metrics, NP_only, remove_nested,
+        keep_singletons, min_span, shard, state_file, key_cache=None):
+    """Writes the Evaluators of a shard of the documents to `state_file`,
+    with their per-document counts."""
+    multi_evaluator = evaluator.MultiEvaluator([metric
+            for _, metric in metrics], beta=1, keep_aggregated_values=True)
+    for _, coref_info in reader.iter_coref_infos(key_file, sys_file,
+            NP_only, remove_nested, keep_singletons, min_span, key_cache,
+            shard):
+        multi_evaluator.update(coref_info)
+    evaluators = multi_evaluator.evaluators
+
+    with open(state_file, 'w') as f:
+        json.dump({'shard': list(shard), 'metrics': [name
+                for name, _ in metrics], 'evaluators': [e.to_dict()
+                for e in evaluators]}, f)
+
+
+def reduce_states(state_files, n_resamples=0, seed=None):
+    """Prints the scores of the documents of all the shards of
+    `state_files`, which are merged in the order of the shards."""
+    states = []
+    for state_file in state_files:
+        with open(state_file) as f:
+            states.append(json.load(f))
+    states.sort(key=lambda state: state['shard'][0])
+
+    shards = [tuple(state['shard']) for state in states]
+    shards_num = shards[0][1] if shards else 0
+    if shards != [(index, shards_num) for index in range(shards_num)] or (
+            any(state['metrics'] != states[0]['metrics']
+            for state in states)):
+        raise ValueError('The state files are not the shards 0 to %d of '
+                'the same evaluation: %s' % (shards_num - 1, shards))
+
+    evaluators = [evaluator.Evaluator(e.metric, e.beta,
+            keep_aggregated_values=True) for e in map(evaluator.from_dict,
+            states[0]['evaluators'])]
+    for state in states:
+        for e, e_state in zip(evaluators, state['evaluators']):
+            e.merge(evaluator.from_dict(e_state))
+
+    intervals = conll_interval = None
+    if n_resamples:
+        intervals, conll_interval = bootstrap.get_confidence_intervals(
+                evaluators, n_resamples, seed=seed)
+    print_scores(states[0]['metrics'], evaluators, intervals,
+            conll_interval)
+
+
+def evaluate_batch(key_file, sys_files, metrics, NP_only, remove_nested,
+        keep_singletons, min_span, jobs=1, key_cache=None):
+    key_documents = batch.KeyDocuments(key_file, NP_only, remove_nested,
+            keep_singletons, min_span, key_cache)
+
+    names = [name for name, _ in metrics]
+    has_conll = all(name in names for name in ["muc", "bcub", "ceafe"])
+    print('\t'.join(['system'] + ['%s %s' % (name, score) for name in names
+            for score in ['R', 'P', 'F1']] + (['CoNLL'] if has_conll else [])))
+
+    for sys_file, evaluators, _ in batch.evaluate_systems(key_documents,
+            sys_files, metrics, jobs):
+        row = [sys_file]
+        for e in evaluators:
+            row.extend('%.2f' % (score * 100) for score in [e.get_recall(),
+                    e.get_precision(), e.get_f1()])
+        if has_conll:
+            row.append('%.2f' % (get_conll_score(evaluators) * 100))
+        print('\t'.join(row))
 
 
 def evaluate(key_file, sys_file, metrics, NP_only, remove_nested,
-        keep_singletons, min_span):
-    doc_coref_infos = reader.get_coref_infos(key_file, sys_file, NP_only,
-            remove_nested, keep_singletons, min_span)
+        keep_singletons, min_span, jobs=1, key_cache=None, n_resamples=0,
+        seed=None, doc_store=None):
+    keep_aggregated_values = n_resamples > 0
+    if doc_store:
+        evaluators = store.evaluate(doc_store, key_file, sys_file,
+                [metric for _, metric in metrics], NP_only, remove_nested,
+                keep_singletons, min_span,
+                keep_aggregated_values=keep_aggregated_values)
+    elif jobs == 1:
+        evaluators = evaluator.evaluate_doc_stream(reader.iter_coref_infos(
+                key_file, sys_file, NP_only, remove_nested, keep_singletons,
+                min_span, key_cache), [metric for _, metric in metrics],
+                beta=1,
+                keep_aggregated_values=keep_aggregated_values).evaluators
+    else:
+        evaluators = parallel.evaluate_documents(key_file, sys_file, metrics,
+                NP_only, remove_nested, keep_singletons, min_span, jobs,
+                keep_aggregated_values=keep_aggregated_values,
+                key_cache=key_cache)
+
+    intervals = conll_interval = None
+    if n_resamples:
+        intervals, conll_interval = bootstrap.get_confidence_intervals(
+                evaluators, n_resamples, seed=seed)
+    print_scores([name for name, _ in metrics], evaluators, intervals,
+            conll_interval)
 
-    conll = 0
-    conll_subparts_num = 0
 
-    for name, metric in metrics:
-        recall, precision, f1 = evaluator.evaluate_documents(doc_coref_infos,
-                metric,
-                beta=1)
-        if name in ["muc", "bcub", "ceafe"]:
-            conll += f1
-            conll_subparts_num += 1
+def get_conll_score(evaluators):
+    """Returns the CoNLL score of `evaluators`, or None if they do not
+    evaluate MUC, B-cubed and CEAFe."""
+    return evaluator.MultiEvaluator([e.metric for e in evaluators],
+            evaluators=evaluators).get_conll_score()
 
+
+def print_scores(names, evaluators, intervals=None, conll_interval=None):
+    for i, (name, e) in enumerate(zip(names, evaluators)):
+        recall, precision, f1 = e.get_recall(), e.get_precision(), e.get_f1()
         print(name.ljust(10), 'Recall: %.2f' % (recall * 100),
                 ' Precision: %.2f' % (precision * 100),
                 ' F1: %.2f' % (f1 * 100))
+        if intervals:
+            print_interval(intervals[i])
+
+    conll = get_conll_score(evaluators)
+    if conll is not None:
+        print('CoNLL score: %.2f' % (conll * 100))
+        if conll_interval:
+            print('95%% CI: [%.2f, %.2f]' % (conll_interval[0] * 100,
+                    conll_interval[1] * 100))
+
+
+def evaluate_subset(doc_store, args, metrics):
+    """Prints the scores of a system file that is scored in `doc_store`,
+    for all its documents or those listed one per line in a file, from the
+    stored counts only.  `args` are the system file and the optional file
+    of document ids."""
+    sys_file = args[0]
+    docs = None
+    if len(args) > 1:
+        with open(args[1]) as f:
+            docs = [line.strip() for line in f if line.strip()]
+    evaluators = store.evaluate_subset(doc_store, sys_file,
+            [metric for _, metric in metrics], docs)
+    print_scores([name for name, _ in metrics], evaluators)
+
+
+def compare(key_file, sys_file, other_sys_file, metrics, NP_only,
+        remove_nested, keep_singletons, min_span, test='randomization',
+        n_rounds=10000, seed=None, jobs=1, key_cache=None):
+    """Prints the scores of the two system files and the p-values of their
+    F1 differences.  The key file is read once for both systems."""
+    key_documents = batch.KeyDocuments(key_file, NP_only, remove_nested,
+            keep_singletons, min_span, key_cache)
+    evaluators_a, _ = key_documents.evaluate(sys_file, metrics,
+            keep_aggregated_values=True)
+    evaluators_b, _ = key_documents.evaluate(other_sys_file, metrics,
+            keep_aggregated_values=True)
+    p_values, conll_p_value = significance.paired_test(evaluators_a,
+            evaluators_b, test, n_rounds, seed, jobs)
+
+    print('Paired %s test with %d rounds' % (test, n_rounds))
+    print('A: %s' % sys_file)
+    print('B: %s' % other_sys_file)
+    for (name, _), e_a, e_b, p_value in zip(metrics, evaluators_a,
+            evaluators_b, p_values):
+        print(name.ljust(10), 'F1 A: %.2f' % (e_a.get_f1() * 100),
+                ' F1 B: %.2f' % (e_b.get_f1() * 100),
+                ' p-value: %.4f' % p_value)
+
+    if conll_p_value is not None:
+        print('CoNLL score A: %.2f' % (get_conll_score(evaluators_a) * 100),
+                ' B: %.2f' % (get_conll_score(evaluators_b) * 100),
+                ' p-value: %.4f' % conll_p_value)
+
 
-    if conll_subparts_num == 3:
-        conll = (conll / 3) * 100
-        print('CoNLL score: %.2f' % conll)
+def print_interval(interval):
+    (r_low, r_high), (p_low, p_high), (f_low, f_high) = interval
+    print(''.ljust(10), '95%% CI Recall: [%.2f, %.2f]' % (r_low * 100,
+            r_high * 100),
+            ' Precision: [%.2f, %.2f]' % (p_low * 100, p_high * 100),
+            ' F1: [%.2f, %.2f]' % (f_low * 100, f_high * 100))
 
 
 if __name__ == '__main__':
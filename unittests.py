@@ -1,7 +1,25 @@
-from pytest import approx
+import glob
+import json
+import numpy as np
+from pytest import approx, raises
 from coval.conll.reader import get_coref_infos
+from coval.conll.reader import get_doc_lines, iter_aligned_doc_lines
+from coval.conll import batch, cache, parallel, parsing, store, util
+from coval.arrau import non_referring as arrau_non_referring
+from coval.arrau import reader as arrau_reader
+from coval.arrau.markable import Markable
+from coval.conll.mention import Mention
+from coval.conll.reader import iter_coref_infos
+from coval.conll.reader import scan_coref_column, tokenize_coref_column
+from coval.conll.reader import AnnotatedParseTrees, extract_annotated_parse
+from coval.conll.reader import remove_nested_coref_mentions
+from coval.conll.reader import get_mention_assignments
+from coval.conll.reader import get_bidirectional_mention_assignments
+from coval.conll.reader import get_shard_range
 from coval.eval.evaluator import evaluate_documents as evaluate
-from coval.eval.evaluator import muc, b_cubed, ceafe, lea
+from coval.eval.evaluator import muc, b_cubed, ceafe, lea, blanc
+from coval.eval.evaluator import get_document_evaluations
+from coval.eval import bootstrap, evaluator, significance
 
 TOL = 1e-4
 
@@ -304,3 +322,642 @@ def test_N5():
 def test_N6():
     doc = read('TC-N.key', 'TC-N-6.response')
     assert evaluate(doc, lea) == approx([0, 0, 0])
+
+
+def test_aligned_doc_lines():
+    key_doc_lines = get_doc_lines('tests/TC-A.key')
+    sys_doc_lines = get_doc_lines('tests/TC-A-3.response')
+    docs = list(iter_aligned_doc_lines('tests/TC-A.key',
+            'tests/TC-A-3.response'))
+    assert [doc for doc, _, _ in docs] == list(key_doc_lines)
+    for doc, key_sentences, sys_sentences in docs:
+        assert key_sentences == key_doc_lines[doc]
+        assert sys_sentences == sys_doc_lines[doc]
+
+
+def test_parallel_evaluation():
+    metrics = [('muc', muc), ('bcub', b_cubed), ('ceafe', ceafe), ('lea', lea)]
+    evaluators = parallel.evaluate_documents('tests/TC-M.key',
+            'tests/TC-M-3.response', metrics, jobs=2,
+            keep_aggregated_values=True)
+    doc = read('TC-M.key', 'TC-M-3.response')
+    for (_, metric), e in zip(metrics, evaluators):
+        assert e.get_aggregated_values() == get_document_evaluations(doc,
+                metric)
+
+
+def test_coref_column_tokenizer():
+    for column in ['-', '(12)', '(3|(7', '7)', '(3|7)', '7)|(3)|(12',
+            '(1)|(2)', '(12)(13)', '()', '(5|8)|6)', '-5)', '(1|']:
+        assert tokenize_coref_column(column) == tuple(
+                tuple(corefs) for corefs in scan_coref_column(column))
+
+
+def test_key_cache(tmp_path):
+    key_cache = cache.KeyCache(str(tmp_path))
+    doc = read('TC-A.key', 'TC-A-4.response')
+    for _ in range(2):
+        cached_doc = dict(iter_coref_infos('tests/TC-A.key',
+                'tests/TC-A-4.response', key_cache=key_cache))
+        assert key_cache.load('tests/TC-A.key') is not None
+        for metric in [muc, b_cubed, ceafe, lea]:
+            assert evaluate(cached_doc, metric) == evaluate(doc, metric)
+
+
+def test_parallel_key_cache(tmp_path):
+    metrics = [('muc', muc), ('bcub', b_cubed)]
+    key_cache = cache.KeyCache(str(tmp_path))
+    doc = read('TC-A.key', 'TC-A-4.response')
+    for _ in range(2):
+        evaluators = parallel.evaluate_documents('tests/TC-A.key',
+                'tests/TC-A-4.response', metrics, jobs=2,
+                key_cache=key_cache)
+        assert key_cache.load('tests/TC-A.key') is not None
+        for (_, metric), e in zip(metrics, evaluators):
+            assert (e.get_recall(), e.get_precision(),
+                    e.get_f1()) == evaluate(doc, metric)
+
+
+def test_batch_evaluation():
+    metrics = [('muc', muc), ('bcub', b_cubed), ('ceafe', ceafe), ('lea', lea)]
+    key_documents = batch.KeyDocuments('tests/TC-A.key')
+    # The key mention index is computed once per document
+    assert all(x is y for (_, (_, _, x)), (_, (_, _, y)) in zip(
+            key_documents.iter_docs(), key_documents.iter_docs()))
+    sys_files = ['tests/TC-A-%d.response' % i for i in [2, 5, 11]]
+    for sys_file, evaluators, _ in batch.evaluate_systems(key_documents,
+            sys_files, metrics, jobs=2):
+        doc = read('TC-A.key', sys_file[len('tests/'):])
+        for (_, metric), e in zip(metrics, evaluators):
+            assert (e.get_recall(), e.get_precision(),
+                    e.get_f1()) == evaluate(doc, metric)
+
+
+SENTENCE = ['d 0 0 John NNP (TOP(S(NP(NP* -\n',
+        'd 0 1 and CC * -\n',
+        'd 0 2 Mary NNP (NP*)) -\n',
+        'd 0 3 left VBD (VP*) -\n',
+        'd 0 4 . . *)) -\n']
+
+
+def test_annotated_parse_trees():
+    sentence = SENTENCE
+    parse_trees = AnnotatedParseTrees([sentence])
+    for start in range(len(sentence)):
+        for end in range(start, len(sentence)):
+            tree = parse_trees.get_tree(0, start, end)
+            assert parse_trees.get_tree(0, start, end) is tree
+            assert str(tree) == str(extract_annotated_parse(
+                    sentence[start:end + 1], start))
+
+
+def test_min_span_memo():
+    parse_trees = AnnotatedParseTrees([SENTENCE])
+    words = ['John', 'and', 'Mary']
+    key_mention = Mention('d', 0, 0, 2, words)
+    sys_mention = Mention('d', 0, 0, 2, list(words))
+    mention = Mention('d', 0, 0, 2, list(words))
+    for m in [key_mention, sys_mention, mention]:
+        m.set_gold_parse(parse_trees.get_tree(0, 0, 2))
+    assert not parse_trees.set_min_span(key_mention)
+    assert parse_trees.set_min_span(sys_mention)
+    mention.set_min_span()
+    assert mention.min_spans
+    assert key_mention.min_spans == sys_mention.min_spans == mention.min_spans
+
+
+def test_remove_nested_coref_mentions(capsys):
+    clusters = [[Mention('d', 0, 0, 4, []), Mention('d', 0, 1, 2, []),
+            Mention('d', 0, 2, 2, []), Mention('d', 1, 1, 2, []),
+            Mention('d', 2, 0, 0, [])],
+            [Mention('d', 0, 0, 1, []), Mention('d', 0, 1, 1, [])]]
+    assert remove_nested_coref_mentions(clusters, False) == (4, 1)
+    assert [[(m.sent_num, m.start, m.end) for m in c]
+            for c in clusters] == [[(0, 0, 4), (1, 1, 2), (2, 0, 0)]]
+    assert capsys.readouterr().out == ''
+
+
+def test_bidirectional_mention_assignments():
+    key = [[Mention('d', 0, 0, 1, []), Mention('d', 0, 3, 3, [])],
+            [Mention('d', 1, 0, 0, []), Mention('d', 0, 0, 1, [])]]
+    response = [[Mention('d', 0, 0, 1, [])],
+            [Mention('d', 0, 3, 3, []), Mention('d', 1, 2, 2, [])]]
+    key_mention_sys_cluster, sys_mention_key_cluster = \
+            get_bidirectional_mention_assignments(key, response)
+    assert key_mention_sys_cluster == get_mention_assignments(key, response)
+    assert sys_mention_key_cluster == get_mention_assignments(response, key)
+    assert sys_mention_key_cluster == {response[0][0]: 1, response[1][0]: 0}
+
+
+class InterruptedParser(parsing.StubParserBackend):
+    def parse_sents(self, sentences):
+        if self.parsed_sents_num:
+            raise KeyboardInterrupt
+        return super().parse_sents(sentences)
+
+
+def test_parse_key_file(tmp_path):
+    key_file = str(tmp_path / 'key')
+    with open('tests/TC-A.key') as f:
+        key = f.read()
+    with open(key_file, 'w') as f:
+        f.write(key)
+
+    try:
+        util.parse_key_file(key_file, InterruptedParser(), batch_size=1)
+    except KeyboardInterrupt:
+        pass
+    parser = parsing.StubParserBackend()
+    parsed_file = util.parse_key_file(key_file, parser, batch_size=1,
+            cache_dir=str(tmp_path / 'cache'))
+    assert parser.parsed_sents_num == 1
+    assert util.check_gold_parse_annotation(parsed_file)
+    with open(parsed_file) as f:
+        assert f.readline() == key.splitlines(True)[0]
+        assert f.readline().split()[3:6] == ['a1', 'NN', '(ROOT(NP*']
+
+    parser = parsing.StubParserBackend()
+    copy_file = str(tmp_path / 'copy')
+    with open(copy_file, 'w') as f:
+        f.write(key)
+    assert util.parse_key_file(key_file, parser) == parsed_file
+    util.parse_key_file(copy_file, parser, cache_dir=str(tmp_path / 'cache'))
+    assert parser.parsed_sents_num == 0
+    with open(parsed_file) as f, open(copy_file + '.parsed') as g:
+        assert f.read() == g.read()
+
+
+def test_sparse_ceaf(monkeypatch):
+    for response in sorted(glob.glob('tests/TC-*.response')):
+        key = response[len('tests/'):response.rindex('-')] + '.key'
+        for coref_info in read(key, response[len('tests/'):]).values():
+            key_clusters, sys_clusters = coref_info[:2]
+            for phi in [evaluator.phi3, evaluator.phi4]:
+                dense = evaluator.dense_ceaf(sys_clusters, key_clusters, phi)
+                assert evaluator.ceaf(sys_clusters, key_clusters,
+                        phi) == dense
+                monkeypatch.setattr(evaluator, 'MAX_DENSE_CEAF_SIZE', 0)
+                assert evaluator.ceaf(sys_clusters, key_clusters,
+                        phi) == dense
+                monkeypatch.undo()
+
+    # Clusters without overlaps are never aligned with a score
+    monkeypatch.setattr(evaluator, 'MAX_DENSE_CEAF_SIZE', 0)
+    gold_clusters = [[Mention('d', 0, i, i, ['w'])] for i in range(5)]
+    clusters = gold_clusters[:2] + [[Mention('d', 0, 9, 9, ['w'])]]
+    assert evaluator.ceafe(clusters, gold_clusters) == (2, 3, 2, 5)
+
+
+def test_contingency_metrics():
+    for response in sorted(glob.glob('tests/TC-*.response')):
+        key = response[len('tests/'):response.rindex('-')] + '.key'
+        for coref_info in read(key, response[len('tests/'):]).values():
+            (key_clusters, sys_clusters, key_mention_sys_cluster,
+                    sys_mention_key_cluster) = coref_info
+            contingency = evaluator.Contingency(coref_info)
+            for metric in [muc, b_cubed]:
+                assert evaluator.get_document_counts(coref_info, metric,
+                        contingency) == metric(sys_clusters,
+                        sys_mention_key_cluster) + metric(key_clusters,
+                        key_mention_sys_cluster)
+            assert evaluator.get_document_counts(coref_info, lea,
+                    contingency) == evaluator.pairwise_lea(sys_clusters,
+                    key_clusters, sys_mention_key_cluster) + \
+                    evaluator.pairwise_lea(key_clusters, sys_clusters,
+                    key_mention_sys_cluster)
+            assert evaluator.get_document_counts(coref_info, ceafe,
+                    contingency) == evaluator.dense_ceaf(sys_clusters,
+                    key_clusters, evaluator.phi4)
+            assert list(contingency.key_only) == [len([m for m in c
+                    if m not in key_mention_sys_cluster])
+                    for c in key_clusters]
+            assert list(contingency.sys_only) == [len([m for m in c
+                    if m not in sys_mention_key_cluster])
+                    for c in sys_clusters]
+
+
+def test_linear_lea():
+    for response in sorted(glob.glob('tests/TC-*.response')):
+        key = response[len('tests/'):response.rindex('-')] + '.key'
+        infos = read(key, response[len('tests/'):])
+        assert get_document_evaluations(infos, lea) == \
+                get_document_evaluations(infos, evaluator.pairwise_lea)
+
+    # A long chain that is split over three clusters and singletons
+    key = [[Mention('d', 0, i, i, []) for i in range(300)]]
+    response = [[m] for m in key[0][:30]] + [key[0][30:100],
+            key[0][100:250], key[0][250:]]
+    key_mention_sys_cluster = get_mention_assignments(key, response)
+    assert lea(key, response, key_mention_sys_cluster) == \
+            evaluator.pairwise_lea(key, response, key_mention_sys_cluster)
+
+
+def blanc_prf(coref, non_coref):
+    """The expected BLANC of the (recall, precision) fractions of the
+    coreference and non-coreference links, or None if the key has no links
+    of that kind."""
+    scores = []
+    for (r_num, r_den), (p_num, p_den) in filter(None, [coref, non_coref]):
+        r = r_num / r_den if r_den else 0
+        p = p_num / p_den if p_den else 0
+        scores.append((r, p, 2 * r * p / (r + p) if r + p else 0))
+    return [sum(values) / len(scores) for values in zip(*scores)]
+
+
+def test_blanc():
+    cases = {
+            'TC-A-1': (((4, 4), (4, 4)), ((11, 11), (11, 11))),
+            'TC-A-2': (((1, 4), (1, 1)), ((2, 11), (2, 2))),
+            'TC-A-3': (((4, 4), (4, 9)), ((11, 11), (11, 27))),
+            'TC-A-4': (((1, 4), (1, 4)), ((5, 11), (5, 17))),
+            'TC-A-5': (((1, 4), (1, 7)), ((5, 11), (5, 21))),
+            'TC-A-6': (((1, 4), (1, 5)), ((5, 11), (5, 23))),
+            'TC-A-10': (((0, 4), (0, 0)), ((11, 11), (11, 15))),
+            'TC-A-11': (((4, 4), (4, 15)), ((0, 11), (0, 0))),
+            'TC-A-12': (((0, 4), (0, 0)), ((5, 11), (5, 21))),
+            'TC-A-13': (((1, 4), (1, 21)), ((0, 11), (0, 0))),
+            'TC-B-1': (((1, 4), (1, 4)), ((2, 6), (2, 6))),
+            'TC-M-1': (((15, 15), (15, 15)), None),
+            'TC-M-2': (((0, 15), (0, 0)), None),
+            'TC-M-3': (((4, 15), (4, 4)), None),
+            'TC-M-4': (((3, 15), (3, 15)), None),
+            'TC-M-6': (((1, 15), (1, 4)), None),
+            'TC-N-1': (None, ((15, 15), (15, 15))),
+            'TC-N-2': (None, ((0, 15), (0, 0))),
+            'TC-N-3': (None, ((11, 15), (11, 11))),
+            'TC-N-4': (None, ((3, 15), (3, 15))),
+            'TC-N-6': (None, ((2, 15), (2, 11)))}
+    for response, (coref, non_coref) in cases.items():
+        doc = read(response[:response.rindex('-')] + '.key',
+                response + '.response')
+        assert evaluate(doc, blanc) == approx(blanc_prf(coref, non_coref))
+    assert evaluate(read('TC-B.key', 'TC-B-1.response'),
+            blanc)[2] == approx(7 / 24)
+
+
+def test_bootstrap():
+    doc_coref_infos = {}
+    for response in sorted(glob.glob('tests/TC-A-*.response')):
+        for doc, coref_info in read('TC-A.key',
+                response[len('tests/'):]).items():
+            doc_coref_infos[response + doc] = coref_info
+
+    evaluators = []
+    for metric in [muc, b_cubed, ceafe, lea, blanc]:
+        e = evaluator.Evaluator(metric, keep_aggregated_values=True)
+        for coref_info in doc_coref_infos.values():
+            e.update(coref_info)
+        evaluators.append(e)
+        counts = np.array(e.get_counts(), dtype=float)[:, None]
+        assert [scores[0] for scores in bootstrap.get_array_scores(metric,
+                counts)] == approx(evaluator.get_scores(metric,
+                e.get_counts()))
+
+    intervals, conll_interval = bootstrap.get_confidence_intervals(
+            evaluators, 500, seed=1)
+    assert (intervals, conll_interval) == bootstrap.get_confidence_intervals(
+            evaluators, 500, seed=1)
+    for low, high in [bounds for interval in intervals
+            for bounds in interval] + [conll_interval]:
+        assert 0 <= low <= high <= 1
+
+    # Every resample of copies of the same document has its scores
+    coref_info, = read('TC-A.key', 'TC-A-5.response').values()
+    evaluators = [evaluator.Evaluator(metric, keep_aggregated_values=True)
+            for metric in [muc, b_cubed, ceafe]]
+    for e in evaluators:
+        for _ in range(5):
+            e.update(coref_info)
+    intervals, conll_interval = bootstrap.get_confidence_intervals(
+            evaluators, 100, seed=1)
+    for e, interval in zip(evaluators, intervals):
+        for (low, high), score in zip(interval, [e.get_recall(),
+                e.get_precision(), e.get_f1()]):
+            assert (low, high) == approx((score, score))
+    conll = sum(e.get_f1() for e in evaluators) / 3
+    assert conll_interval == approx((conll, conll))
+
+
+def test_paired_significance(monkeypatch):
+    responses = sorted(glob.glob('tests/TC-A-*.response'))
+    coref_infos = [list(read('TC-A.key', response[len('tests/'):]).values())[0]
+            for response in responses]
+    metrics = [muc, b_cubed, ceafe, lea, blanc]
+
+    def get_evaluators(coref_infos):
+        evaluators = [evaluator.Evaluator(metric, keep_aggregated_values=True)
+                for metric in metrics]
+        for e in evaluators:
+            for coref_info in coref_infos:
+                e.update(coref_info)
+        return evaluators
+
+    evaluators_a = get_evaluators(coref_infos)
+    evaluators_b = get_evaluators(coref_infos[1:] + coref_infos[:1])
+    for test in significance.TESTS:
+        p_values, conll_p_value = significance.paired_test(evaluators_a,
+                evaluators_a, test, 200, seed=1)
+        assert p_values == [1.0] * len(metrics) and conll_p_value == 1.0
+
+        monkeypatch.setattr(bootstrap, 'MAX_CHUNK_CELLS', 7 * len(responses))
+        results = significance.paired_test(evaluators_a, evaluators_b, test,
+                200, seed=1)
+        assert results == significance.paired_test(evaluators_a,
+                evaluators_b, test, 200, seed=1, jobs=2)
+        assert all(1 / 201 <= p <= 1 for p in results[0] + [results[1]])
+        monkeypatch.undo()
+
+
+def test_incremental_evaluator():
+    responses = sorted(glob.glob('tests/TC-A-*.response'))
+    coref_infos = [list(read('TC-A.key', response[len('tests/'):]).values())[0]
+            for response in responses]
+
+    for metric in [muc, b_cubed, ceafe, lea, blanc]:
+        e = evaluator.Evaluator(metric, keep_aggregated_values=True)
+        current = {}
+        for doc_id, coref_info in enumerate(coref_infos):
+            e.add(doc_id, coref_info)
+            current[doc_id] = coref_info
+        for doc_id in range(0, len(coref_infos), 3):
+            e.remove(doc_id)
+            del current[doc_id]
+        for doc_id in range(1, len(coref_infos), 3):
+            e.replace(doc_id, coref_infos[0])
+            current[doc_id] = coref_infos[0]
+        with raises(KeyError):
+            e.add(1, coref_infos[0])
+        # A failed replacement keeps the previous counts
+        counts = e.get_counts()
+        with raises(TypeError):
+            e.replace(1, None)
+        with raises(KeyError):
+            e.replace(0, coref_infos[0])
+        assert e.get_counts() == counts and 1 in e.doc_counts
+
+        expected = evaluator.Evaluator(metric, keep_aggregated_values=True)
+        for coref_info in current.values():
+            expected.update(coref_info)
+        assert e.get_prf() == approx(expected.get_prf())
+        assert [sorted(values) for values in e.get_aggregated_values()] == [
+                approx(sorted(values))
+                for values in expected.get_aggregated_values()]
+
+        for doc_id in current:
+            e.remove(doc_id)
+        assert e.get_counts() == (0,) * len(e.get_counts())
+
+
+def test_merge_serialized_evaluators():
+    responses = sorted(glob.glob('tests/TC-A-*.response'))
+    coref_infos = [list(read('TC-A.key', response[len('tests/'):]).values())[0]
+            for response in responses]
+    ranges = [get_shard_range(len(coref_infos), index, 3)
+            for index in range(3)]
+    assert [start for start, _ in ranges[1:]] == [end for _, end in ranges[:-1]]
+    assert ranges[0][0] == 0 and ranges[-1][1] == len(coref_infos)
+
+    for metric in [muc, b_cubed, ceafe, lea, blanc]:
+        expected = evaluator.Evaluator(metric, keep_aggregated_values=True)
+        for coref_info in coref_infos:
+            expected.update(coref_info)
+
+        merged = evaluator.Evaluator(metric, keep_aggregated_values=True)
+        for start, end in ranges:
+            e = evaluator.Evaluator(metric, keep_aggregated_values=True)
+            for coref_info in coref_infos[start:end]:
+                e.update(coref_info)
+            merged.merge(evaluator.from_dict(json.loads(json.dumps(
+                    e.to_dict()))))
+        assert merged.get_counts() == expected.get_counts()
+        assert merged.get_aggregated_values() == (
+                expected.get_aggregated_values())
+
+        keyed = evaluator.Evaluator(metric)
+        keyed.add('doc', coref_infos[0])
+        merged = evaluator.from_dict(keyed.to_dict())
+        with raises(KeyError):
+            merged.merge(keyed)
+        merged.remove('doc')
+        assert merged.get_counts() == (0,) * len(merged.get_counts())
+
+
+def test_multi_evaluator():
+    doc_coref_infos = {}
+    for response in sorted(glob.glob('tests/TC-A-*.response')):
+        for doc, coref_info in read('TC-A.key',
+                response[len('tests/'):]).items():
+            doc_coref_infos[response + doc] = coref_info
+    metrics = [evaluator.mentions, muc, b_cubed, ceafe, lea, blanc]
+
+    multi_evaluator = evaluator.evaluate_metrics(doc_coref_infos, metrics)
+    for metric, scores in zip(metrics, multi_evaluator.get_scores()):
+        e = evaluator.Evaluator(metric)
+        for coref_info in doc_coref_infos.values():
+            e.update(coref_info)
+        assert scores == (e.get_recall(), e.get_precision(), e.get_f1())
+    conll = sum(f1 for _, _, f1 in multi_evaluator.get_scores()[1:4]) / 3
+    assert multi_evaluator.get_conll_score() == approx(conll)
+    assert evaluator.MultiEvaluator([muc]).get_conll_score() is None
+
+    multi_evaluator = evaluator.MultiEvaluator(metrics)
+    coref_info = next(iter(doc_coref_infos.values()))
+    multi_evaluator.add('doc', coref_info)
+    scores = multi_evaluator.get_scores()
+    with raises(TypeError):
+        multi_evaluator.replace('doc', None)
+    with raises(KeyError):
+        multi_evaluator.replace('other', coref_info)
+    assert multi_evaluator.get_scores() == scores
+
+
+def test_document_store(tmp_path, capsys):
+    metrics = [evaluator.mentions, muc, b_cubed, ceafe, lea, blanc]
+    doc_store = store.DocumentStore(str(tmp_path / 'store.db'))
+    for response in ['tests/TC-A-2.response', 'tests/TC-A-3.response']:
+        expected = evaluator.evaluate_metrics(dict(iter_coref_infos(
+                'tests/TC-A.key', response)), metrics).evaluators
+        for _ in range(2):
+            evaluators = store.evaluate(doc_store, 'tests/TC-A.key', response,
+                    metrics[:3])
+            evaluators = store.evaluate(doc_store, 'tests/TC-A.key', response,
+                    metrics)
+            assert [e.get_counts() for e in evaluators] == [
+                    e.get_counts() for e in expected]
+        assert 'The counts of 1 of 1 documents' in capsys.readouterr().out
+
+        subset = store.evaluate_subset(doc_store, response, metrics)
+        assert [e.get_counts() for e in subset] == [
+                e.get_counts() for e in expected]
+        docs = [doc for doc, _ in doc_store.get_run_docs(
+                store.get_run_name(response))]
+        assert [e.get_counts() for e in store.evaluate_subset(doc_store,
+                response, metrics, docs)] == [e.get_counts()
+                for e in expected]
+        assert store.evaluate_subset(doc_store, response, [muc],
+                [])[0].get_counts() == (0, 0, 0, 0)
+        with raises(KeyError):
+            store.evaluate_subset(doc_store, response, metrics, ['unknown'])
+    doc_store.close()
+
+
+def test_evaluate_doc_stream():
+    metrics = [muc, b_cubed, ceafe, lea, blanc]
+    for response in sorted(glob.glob('tests/TC-A-*.response'))[:4]:
+        expected = evaluator.evaluate_metrics(dict(iter_coref_infos(
+                'tests/TC-A.key', response)), metrics,
+                keep_aggregated_values=True)
+        multi_evaluator = evaluator.evaluate_doc_stream(iter_coref_infos(
+                'tests/TC-A.key', response), metrics,
+                keep_aggregated_values=True)
+        for e, expected_e in zip(multi_evaluator.evaluators,
+                expected.evaluators):
+            assert e.get_counts() == expected_e.get_counts()
+            assert e.get_aggregated_values() == (
+                    expected_e.get_aggregated_values())
+            assert [values.tolist() for values in
+                    e.get_aggregated_arrays()] == list(
+                    e.get_aggregated_values())
+        # The integer counts stay integers
+        muc_values, bcub_values = [e.get_aggregated_values()
+                for e in multi_evaluator.evaluators[:2]]
+        assert all(type(count) == int for values in muc_values
+                for count in values)
+        assert all(type(count) == int for count in bcub_values[1])
+        assert all(type(count) == float for count in bcub_values[0])
+
+
+def test_non_referrings():
+    def non_referring(start, end, MIN=None):
+        return Markable('doc', start, end, MIN, 'non_referring', [])
+
+    key = [non_referring(0, 3, (2, 2)), non_referring(5, 5),
+            non_referring(7, 9, (8, 9)), non_referring(12, 13)]
+    response = [non_referring(1, 2), non_referring(5, 5),
+            non_referring(7, 8), non_referring(20, 21)]
+    assert arrau_non_referring.non_referrings(key, response) == (2, 4, 2, 4)
+    assert arrau_non_referring.non_referrings(key, response) == \
+            arrau_non_referring.pairwise_non_referrings(key, response)
+
+    doc_non_referring_infos = {'a': (key, response), 'b': (key, key[:1]),
+            'c': (key[1:], response)}
+    recall, precision, f1 = arrau_non_referring.evaluate_non_referrings(
+            doc_non_referring_infos)
+    assert (recall, precision, f1) == approx((4 / 11, 4 / 9, 2 / 5))
+    e = arrau_non_referring.get_non_referring_evaluator(
+            doc_non_referring_infos, keep_aggregated_values=True)
+    assert e.get_aggregated_values()[0] == [2, 1, 1]
+    merged = evaluator.from_dict(e.to_dict())
+    assert merged.get_prf() == e.get_prf()
+    assert evaluator.evaluate_non_referrings(doc_non_referring_infos) == (
+            recall, precision, f1)
+
+
+def test_markable_assignments():
+    def referring(start, end, MIN=None):
+        return Markable('doc', start, end, MIN, 'referring', [])
+
+    key = [[referring(0, 4, (2, 2)), referring(6, 6)],
+            [referring(8, 10, (9, 9)), referring(12, 13)]]
+    response = [[referring(1, 3), referring(8, 9)],
+            [referring(0, 2), referring(6, 6), referring(12, 12)]]
+    key_assignments = arrau_reader.get_markable_assignments(key, response)
+    # (0, 4) matches both (1, 3) and (0, 2), and the first one is used
+    assert list(key_assignments.values()) == [0, 1, 0]
+    sys_assignments = arrau_reader.get_markable_assignments(response, key)
+    assert list(sys_assignments.values()) == [0, 1, 0, 0]
+    for inp_clusters, out_clusters in [(key, response), (response, key)]:
+        assert list(arrau_reader.get_markable_assignments(inp_clusters,
+                out_clusters).items()) == list(
+                arrau_reader.get_pairwise_markable_assignments(
+                inp_clusters, out_clusters).items())
+
+
+def write_arrau_doc(path, lines):
+    with open(str(path), 'w') as f:
+        f.write('TOKEN\tMARKABLE\tMIN\tCOREF\n')
+        f.write(''.join(line + '\n' for line in lines))
+
+
+def test_lazy_arrau_docs(tmp_path, monkeypatch):
+    for side in ['key', 'sys']:
+        (tmp_path / side / 'sub').mkdir(parents=True)
+    key_lines = ['John\tB-markable_1=set_1\tword_1\treferring',
+            'saw\tB-markable_2=set_2\tword_2\tnon_referring',
+            'him\tB-markable_3=set_1\tword_3\treferring']
+    sys_lines = ['John\tB-markable_1=set_1\t-\treferring',
+            'saw\tB-markable_2=set_2\t-\tnon_referring',
+            'him\tB-markable_3=set_2\t-\treferring']
+    for i in range(3):
+        write_arrau_doc(tmp_path / 'key' / 'sub' / ('doc%d.CONLL' % i),
+                key_lines)
+        write_arrau_doc(tmp_path / 'sys' / ('doc%d.CONLL' % i),
+                sys_lines if i else key_lines)
+
+    read_files = []
+    get_doc_lines = arrau_reader.get_doc_lines
+    monkeypatch.setattr(arrau_reader, 'get_doc_lines',
+            lambda path: read_files.append(path) or get_doc_lines(path))
+    docs = arrau_reader.get_all_docs(str(tmp_path / 'key'))
+    assert sorted(docs) == ['doc0.CONLL', 'doc1.CONLL', 'doc2.CONLL']
+    assert 'doc1.CONLL' in docs and not read_files
+    assert docs['doc1.CONLL'] == [line + '\n' for line in key_lines]
+    assert len(read_files) == 1
+
+    infos = list(arrau_reader.iter_coref_infos(str(tmp_path / 'key'),
+            str(tmp_path / 'sys'), True, True, False, prefetch_docs=2))
+    doc_coref_infos, doc_non_referring_infos = arrau_reader.get_coref_infos(
+            str(tmp_path / 'key'), str(tmp_path / 'sys'), True, True, False)
+    assert [doc for doc, _, _ in infos] == list(doc_coref_infos)
+    assert [evaluate({doc: coref_info}, muc) for doc, coref_info, _
+            in infos] == [evaluate({doc: doc_coref_infos[doc]}, muc)
+            for doc in doc_coref_infos]
+    assert evaluate({'doc0.CONLL': doc_coref_infos['doc0.CONLL']}, muc) == (
+            1, 1, 1)
+    assert evaluator.evaluate_non_referrings(doc_non_referring_infos) == (
+            1, 1, 1)
+
+
+def test_doc_markables(capsys):
+    def get_spans(clusters):
+        return [(cluster_id, tag, [(m.start, m.end, m.MIN, m.is_referring,
+                m.words) for m in markables])
+                for cluster_id, (markables, tag) in clusters.items()]
+
+    lines = ['John\tB-markable_1=set_1@B-markable_4=set_2\tword_1@word_1'
+                '\treferring@referring',
+            'and\tI-markable_4=set_2\tx\treferring',
+            'Mary\tB-markable_2=set_1@I-markable_4=set_2\tword_3@x'
+                '\treferring@referring',
+            'left',
+            'it\tB-markable_3=set_3\tword_5..word_6\tnon_referring',
+            'rained\tI-markable_3=set_3\tx\tnon_referring']
+    doc_lines = [line + '\n' for line in lines]
+    clusters = arrau_reader.get_doc_markables('doc', doc_lines, True)
+    assert [m.MIN for markables, _ in clusters.values()
+            for m in markables] == [(0, 0), (2, 2), (0, 0), (4, 5)]
+    clusters = arrau_reader.get_doc_markables('doc', doc_lines, False)
+    assert get_spans(clusters) == [
+            (1, 'referring', [(0, 0, None, 'referring', ['John']),
+                (2, 2, None, 'referring', ['Mary'])]),
+            (2, 'referring', [(0, 2, None, 'referring',
+                ['John', 'and', 'Mary'])]),
+            (3, 'non_referring', [(4, 5, None, 'non_referring',
+                ['it', 'rained'])])]
+
+    (processed_clusters, non_referrings, removed_non_referring,
+            removed_singletons) = arrau_reader.process_clusters(clusters,
+            False, True)
+    assert [[m.words for m in markables]
+            for markables in processed_clusters] == [[['John'], ['Mary']]]
+    assert [m.words for m in non_referrings] == [['it', 'rained']]
+    assert (removed_non_referring, removed_singletons) == (0, 1)
+    assert arrau_reader.process_clusters(clusters, True, False)[2:] == (1, 0)
+
+    # Malformed annotations are reported and skipped
+    doc_lines[1] = 'and\tX-markable_4=set_2\tx\treferring\n'
+    clusters = arrau_reader.get_doc_markables('doc', doc_lines, True)
+    assert 'is not a valid annotation' in capsys.readouterr().out
+    assert [(m.start, m.end, m.MIN) for markables, _ in clusters.values()
+            for m in markables] == [(0, 0, (0, 0)), (2, 2, (2, 2)),
+            (0, 2, (0, 0)), (4, 5, (4, 5))]